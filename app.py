@@ -1,12 +1,18 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
+import numpy as np
 import json
 import time
 import hashlib
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import watchlist_manager as wm
-from sparkline import create_sparkline
+import market_data as md
+import portfolio
+import indicators
+from fragment_cache import FragmentCache
+from price_store import PriceStore
+from sparkline import create_sparkline, downsample_minmax
 
 CASH_TICKER = getattr(wm, "CASH_TICKER", "CASH_TWD")
 
@@ -402,6 +408,8 @@ st.markdown("""
 def get_market_type(ticker):
     if is_cash_ticker(ticker): return "cash"
     if ".TW" in ticker: return "tw"
+    if ticker.endswith(".T"): return "jp"
+    if ticker.endswith(".HK"): return "hk"
     if "-" in ticker: return "crypto"
     return "us"
 
@@ -409,6 +417,8 @@ def get_market_color(mtype):
     if mtype == "cash": return "#7DD3FC"
     if mtype == "tw": return "#00C853"
     if mtype == "us": return "#FF3D00"
+    if mtype == "jp": return "#F06292"
+    if mtype == "hk": return "#BA68C8"
     return "#FFD600"
 
 YAHOO_SYMBOL_OVERRIDES = {
@@ -418,7 +428,10 @@ YAHOO_SYMBOL_OVERRIDES = {
 }
 
 def get_yahoo_symbol(ticker):
-    return YAHOO_SYMBOL_OVERRIDES.get(ticker, ticker)
+    return md.resolve_yahoo_symbol(ticker, wm.get_symbol_registry(), YAHOO_SYMBOL_OVERRIDES)
+
+def get_alternate_yahoo_symbol(ticker, yahoo_symbol):
+    return md.alternate_yahoo_symbol(ticker, yahoo_symbol, YAHOO_SYMBOL_OVERRIDES)
 
 def get_default_urls(ticker):
     if is_cash_ticker(ticker):
@@ -435,168 +448,229 @@ def get_default_urls(ticker):
     tv_url = f"https://tw.tradingview.com/symbols/{tv_sym}/"
     return y_url, tv_url
 
-@st.cache_data(ttl=60)
-def get_hist_data(ticker, period):
-    if is_cash_ticker(ticker):
-        return pd.DataFrame()
+@st.cache_resource
+def get_price_store():
+    return PriceStore()
 
-    intervals = {'1D': '5m', '7D': '1h', '1M': '1d', '1Y': '1wk', 'ALL': '1mo'}
-    yf_period = {'1D': '1d', '7D': '5d', '1M': '1mo', '1Y': '1y', 'ALL': 'max'}[period]
-    
-    def fetch_hist(t_sym):
-        try:
-            return yf.Ticker(t_sym).history(period=yf_period, interval=intervals[period])
-        except:
-            return pd.DataFrame()
-            
-    yahoo_symbol = get_yahoo_symbol(ticker)
-    df = fetch_hist(yahoo_symbol)
-    if df.empty and ticker.endswith(".TW") and yahoo_symbol == ticker:
-        # Fallback to .TWO
-        df = fetch_hist(ticker.replace(".TW", ".TWO"))
-        
-    return df
+@st.cache_resource
+def get_fragment_cache():
+    return FragmentCache()
 
-def _normalize_hist_frame(df):
-    if df is None or df.empty:
-        return pd.DataFrame()
+@st.cache_resource
+def get_indicator_engine():
+    return indicators.IndicatorEngine()
 
-    if isinstance(df.columns, pd.MultiIndex):
-        df = df.droplevel(0, axis=1)
+@st.cache_resource
+def get_canonical_frames():
+    store = get_price_store()
+    return {kind: md.CanonicalFrames(store, kind) for kind in md.CANONICAL_SERIES}
 
-    if "Close" not in df.columns and "Adj Close" in df.columns:
-        df = df.copy()
-        df["Close"] = df["Adj Close"]
+@st.cache_resource
+def get_market_data_worker():
+    worker = md.MarketDataWorker(get_canonical_frames(), wm.get_symbol_registry(), YAHOO_SYMBOL_OVERRIDES)
+    return worker.start()
 
-    if "Close" not in df.columns:
+@st.cache_data(ttl=60)
+def get_hist_data(ticker, period):
+    if is_cash_ticker(ticker):
         return pd.DataFrame()
+    return get_period_batch_loader(period)((ticker,), period).get(ticker, pd.DataFrame())
 
-    return df.dropna(subset=["Close"])
+def _fetch_with_tw_fallback(market_tickers, fetch):
+    return md.fetch_with_fallback(market_tickers, fetch, wm.get_symbol_registry(), YAHOO_SYMBOL_OVERRIDES)
 
-@st.cache_data(ttl=60, show_spinner=False)
-def get_hist_data_batch(tickers, period):
+def _split_market_tickers(tickers):
     tickers = tuple(dict.fromkeys(str(t).strip() for t in tickers if str(t).strip()))
-    if not tickers:
-        return {}
     market_tickers = tuple(ticker for ticker in tickers if not is_cash_ticker(ticker))
+    return tickers, market_tickers
+
+def _load_period_batch(tickers, period):
+    tickers, market_tickers = _split_market_tickers(tickers)
     results = {ticker: pd.DataFrame() for ticker in tickers}
-    if not market_tickers:
-        return results
+    if market_tickers:
+        # canonical series 由背景 worker 保持最新；這裡只同步補抓從未載入過的標的，各週期再用 resample 推導
+        frames = get_canonical_frames()[md.PERIOD_SOURCES[period]]
+        canonical = _fetch_with_tw_fallback(
+            market_tickers,
+            lambda symbols: frames.refresh(symbols, missing_only=True),
+        )
+        results.update({ticker: md.derive_period(df, period) for ticker, df in canonical.items()})
+    return results
 
-    intervals = {'1D': '5m', '7D': '1h', '1M': '1d', '1Y': '1wk', 'ALL': '1mo'}
-    yf_period = {'1D': '1d', '7D': '5d', '1M': '1mo', '1Y': '1y', 'ALL': 'max'}[period]
+@st.cache_data(ttl=60, show_spinner=False)
+def get_hist_data_batch(tickers, period):
+    return _load_period_batch(tickers, period)
 
-    download_map = {ticker: get_yahoo_symbol(ticker) for ticker in market_tickers}
-    download_symbols = tuple(dict.fromkeys(download_map.values()))
-    try:
-        raw = yf.download(
-            list(download_symbols),
-            period=yf_period,
-            interval=intervals[period],
-            group_by="ticker",
-            threads=True,
-            progress=False,
-            auto_adjust=False,
-        )
-    except Exception:
-        raw = pd.DataFrame()
-
-    if not raw.empty:
-        if len(download_symbols) == 1:
-            results[market_tickers[0]] = _normalize_hist_frame(raw)
-        elif isinstance(raw.columns, pd.MultiIndex):
-            level0 = set(raw.columns.get_level_values(0))
-            level1 = set(raw.columns.get_level_values(1))
-            for ticker in market_tickers:
-                yahoo_symbol = download_map[ticker]
-                try:
-                    if yahoo_symbol in level0:
-                        results[ticker] = _normalize_hist_frame(raw[yahoo_symbol])
-                    elif yahoo_symbol in level1:
-                        results[ticker] = _normalize_hist_frame(raw.xs(yahoo_symbol, axis=1, level=1))
-                except Exception:
-                    results[ticker] = pd.DataFrame()
-
-    fallback_map = {
-        ticker: ticker.replace(".TW", ".TWO")
-        for ticker in market_tickers
-        if ticker.endswith(".TW") and results[ticker].empty and download_map[ticker] == ticker
-    }
-    if fallback_map:
-        try:
-            fallback_raw = yf.download(
-                list(fallback_map.values()),
-                period=yf_period,
-                interval=intervals[period],
-                group_by="ticker",
-                threads=True,
-                progress=False,
-                auto_adjust=False,
-            )
-        except Exception:
-            fallback_raw = pd.DataFrame()
-
-        if not fallback_raw.empty:
-            if len(fallback_map) == 1:
-                original = next(iter(fallback_map))
-                results[original] = _normalize_hist_frame(fallback_raw)
-            elif isinstance(fallback_raw.columns, pd.MultiIndex):
-                level0 = set(fallback_raw.columns.get_level_values(0))
-                level1 = set(fallback_raw.columns.get_level_values(1))
-                for original, fallback in fallback_map.items():
-                    try:
-                        if fallback in level0:
-                            results[original] = _normalize_hist_frame(fallback_raw[fallback])
-                        elif fallback in level1:
-                            results[original] = _normalize_hist_frame(fallback_raw.xs(fallback, axis=1, level=1))
-                    except Exception:
-                        results[original] = pd.DataFrame()
+INTRADAY_TTL_SECONDS = 15
 
-    return results
+@st.cache_data(ttl=INTRADAY_TTL_SECONDS, show_spinner=False)
+def get_intraday_data_batch(tickers, period="1D"):
+    """1D/7D 走勢：每次只補抓最後一根 5m K 棒之後的資料，可支援 30 秒自動刷新。"""
+    return _load_period_batch(tickers, period)
 
-@st.cache_data(ttl=60)
-def get_live_price(ticker):
+def prime_canonical_series(tickers, refresh_interval=60):
+    """
+    把整個 watchlist（含各幣別的 TWD 匯率代號）交給背景 worker 定期更新。
+    rerun 不會同步等待下載：尚未載入的標的由 worker 在背景補抓，畫面先顯示 placeholder。
+    """
+    _, market_tickers = _split_market_tickers(tickers)
+    get_market_data_worker().watch(market_tickers, refresh_interval)
+
+def request_market_data(tickers):
+    """畫面上要顯示的標的若還沒載入，請背景 worker 優先抓取。"""
+    _, market_tickers = _split_market_tickers(tickers)
+    pending = tuple(
+        ticker for ticker in market_tickers
+        if not all(is_market_data_ready(ticker, period) for period in ("1D", "1M"))
+    )
+    if pending:
+        get_market_data_worker().request_load(pending)
+
+def _resolved_frame(ticker, kind):
+    """從記憶體中的 canonical series 取出標的資料（含 .TW/.TWO 備援），不會觸發下載。"""
+    frames = get_canonical_frames()[kind]
+    symbol = get_yahoo_symbol(ticker)
+    frame = frames.get(symbol)
+    alternate = get_alternate_yahoo_symbol(ticker, symbol) if frame.empty else None
+    if alternate:
+        return alternate, frames.get(alternate)
+    return symbol, frame
+
+def is_market_data_ready(ticker, period="1D"):
+    if is_cash_ticker(ticker):
+        return True
+    frames = get_canonical_frames()[md.PERIOD_SOURCES[period]]
+    symbol = get_yahoo_symbol(ticker)
+    if not frames.loaded(symbol):
+        return False
+    alternate = get_alternate_yahoo_symbol(ticker, symbol) if frames.get(symbol).empty else None
+    return alternate is None or frames.loaded(alternate)
+
+def peek_live_price(ticker):
     if is_cash_ticker(ticker):
         return 1.0
+    return md.latest_close(_resolved_frame(ticker, "intraday")[1])
 
-    def fetch_price(t_sym):
-        try:
-            t = yf.Ticker(t_sym)
-            return t.fast_info.get('lastPrice', None) or t.fast_info.get('currentPrice', None)
-        except:
-            return None
-            
-    yahoo_symbol = get_yahoo_symbol(ticker)
-    price = fetch_price(yahoo_symbol)
-    if price is None and ticker.endswith(".TW") and yahoo_symbol == ticker:
-        # Fallback to .TWO
-        price = fetch_price(ticker.replace(".TW", ".TWO"))
-        
-    return price
+def get_period_prices(ticker, period):
+    """(週期起始價, 最新價)：查 worker 下載後預先算好的表；最新價優先用 5m 的最後一根。"""
+    if is_cash_ticker(ticker):
+        return 1.0, 1.0
+    frames = get_canonical_frames()
+    kind = md.PERIOD_SOURCES[period]
+    start, last = frames[kind].period_prices(_resolved_frame(ticker, kind)[0], period)
+    if kind != "intraday":
+        live = frames["intraday"].period_prices(_resolved_frame(ticker, "intraday")[0], "1D")[1]
+        last = live if live is not None else last
+    return start, last
+
+def compute_metrics(items, period):
+    markets, starts, lasts = {}, {}, {}
+    for item in items:
+        ticker = item["ticker"]
+        markets[ticker] = get_market_type(ticker)
+        starts[ticker], lasts[ticker] = get_period_prices(ticker, period)
+    return portfolio.build_metrics(items, markets, starts, lasts, get_fx_rates(items))
+
+def get_metrics(period):
+    """
+    整個 watchlist 在 `period` 的 metrics table（最新價、漲跌、市值、成本、損益）。
+    卡片、清單、排序與 Portfolio Summary 都讀這張表；canonical series 更新後（version 改變）才重算。
+    """
+    version = tuple(frames.version for frames in get_canonical_frames().values())
+    cached = _run_metrics.get(period)
+    if cached is None or cached[0] != version:
+        cached = (version, compute_metrics(data, period))
+        _run_metrics[period] = cached
+    return cached[1]
+
+def get_indicators():
+    """
+    整個 watchlist 的技術指標表（MA、RSI、布林通道、距高點回撤、52 週區間），由日線 canonical series 計算。
+    日線 version 改變才重算，而且 IndicatorEngine 只處理新收盤的 K 棒。
+    """
+    version = get_canonical_frames()["daily"].version
+    cached = _run_indicators.get("table")
+    if cached is None or cached[0] != version:
+        frames = {
+            item["ticker"]: _resolved_frame(item["ticker"], "daily")
+            for item in data
+            if not is_cash_ticker(item["ticker"])
+        }
+        cached = (version, indicators.build_table(get_indicator_engine(), frames))
+        _run_indicators["table"] = cached
+    return cached[1]
+
+def indicator_values(ticker):
+    """卡片與清單顯示用的指標（也是 fragment cache key 的一部分）。"""
+    table = get_indicators()
+    return tuple(
+        portfolio.metric_value(table, ticker, col)
+        for col in ("rsi14", "bb_pct", "ma20_gap_pct", "ma50_gap_pct", "ma200_gap_pct", "drawdown_pct", "range_52w_pct")
+    )
 
-@st.cache_data(ttl=3600)
-def get_usdtwd_rate():
-    try:
-        t = yf.Ticker("USDTWD=X")
-        return t.fast_info.get('lastPrice', 32.0) or 32.0
-    except:
-        return 32.0
+def build_indicator_html(values, compact=False):
+    rsi, bb_pct, *ma_gaps, drawdown, range_52w = values
+    parts = []
+    if rsi is not None:
+        rsi_color = "#FFB74D" if rsi >= 70 or rsi <= 30 else "#BBB"
+        parts.append(f"<span style='color:{rsi_color};'>RSI {rsi:.0f}</span>")
+    if bb_pct is not None:
+        # %B 超過 100 / 低於 0 代表收在布林通道之外
+        bb_color = "#FFB74D" if bb_pct > 100 or bb_pct < 0 else "#BBB"
+        parts.append(f"<span style='color:{bb_color};'>%B {bb_pct:.0f}</span>")
+    if not compact:
+        for window, gap in zip(indicators.MA_WINDOWS, ma_gaps):
+            if gap is not None:
+                above = gap >= 0
+                parts.append(f"<span style='color:{'#FF3D00' if above else '#00C853'};'>MA{window} {'▲' if above else '▼'}</span>")
+    if drawdown is not None:
+        parts.append(f"DD {drawdown:.1f}%")
+    if range_52w is not None:
+        parts.append(f"52W {range_52w:.0f}%")
+    if not parts:
+        return ""
+    return f"<div style='color:#999; font-size:0.8rem;'>{' · '.join(parts)}</div>"
+
+def get_period_batch_loader(period):
+    return get_intraday_data_batch if md.PERIOD_SOURCES[period] == "intraday" else get_hist_data_batch
+
+def item_currency(item):
+    return portfolio.instrument_currency(item, is_cash=is_cash_ticker(item.get("ticker")))
+
+def get_fx_symbols(items):
+    """持有標的用到的外幣 → TWD 匯率代號（例如 USDTWD=X、JPYTWD=X），交給 worker 跟著更新。"""
+    symbols = {portfolio.fx_symbol(item_currency(item)) for item in items}
+    return sorted(symbol for symbol in symbols if symbol)
+
+def get_fx_rates(items):
+    """幣別 → TWD 匯率表；匯率尚未載入時 USD 退回預設值，其他幣別留空（不計入 TWD 合計）。"""
+    rates = {}
+    for currency in {item_currency(item) for item in items}:
+        symbol = portfolio.fx_symbol(currency)
+        rate = peek_live_price(symbol) if symbol else 1.0
+        rates[currency] = rate or portfolio.DEFAULT_FX_RATES.get(currency)
+    return rates
+
+def currency_html(item):
+    return f"<span class='curr-sym'>{portfolio.currency_symbol(item_currency(item))}</span>"
 
 _run_hist_cache = {}
-_run_price_cache = {}
-_run_usdtwd_rate = None
+_run_metrics = {}
+_run_indicators = {}
+# 排序選項 → (指標欄位, ascending)；沒有日線資料的標的排最後
+INDICATOR_SORTS = {
+    "RSI (High > Low)": ("rsi14", False),
+    "RSI (Low > High)": ("rsi14", True),
+    "Bollinger %B (High > Low)": ("bb_pct", False),
+    "Bollinger %B (Low > High)": ("bb_pct", True),
+    "Price vs MA50 (Above > Below)": ("ma50_gap_pct", False),
+    "Price vs MA200 (Above > Below)": ("ma200_gap_pct", False),
+    "Drawdown from High (Deepest)": ("drawdown_pct", True),
+    "52W Range (Low > High)": ("range_52w_pct", True),
+}
 CARD_PAGE_SIZE = 15
-
-def _latest_close(df):
-    if df is None or df.empty or "Close" not in df.columns:
-        return None
-    close = df["Close"].dropna()
-    if close.empty:
-        return None
-    try:
-        return float(close.iloc[-1])
-    except Exception:
-        return None
+PENDING_POLL_SECONDS = 2
+LOADING_HTML = "<div style='color:grey'>Loading…</div>"
 
 def _dedupe_tickers(tickers):
     return tuple(sorted({str(t).strip() for t in tickers if str(t).strip()}))
@@ -607,11 +681,8 @@ def prime_hist_data(tickers, period):
     if not missing:
         return
 
-    for ticker, df in get_hist_data_batch(tuple(missing), period).items():
+    for ticker, df in get_period_batch_loader(period)(tuple(missing), period).items():
         _run_hist_cache[(ticker, period)] = df
-        price = _latest_close(df)
-        if price is not None:
-            _run_price_cache.setdefault(ticker, price)
 
 def get_cached_hist_data(ticker, period):
     if is_cash_ticker(ticker):
@@ -622,46 +693,6 @@ def get_cached_hist_data(ticker, period):
         _run_hist_cache[key] = get_hist_data(ticker, period)
     return _run_hist_cache[key]
 
-def get_cached_live_price(ticker, preferred_period=None):
-    if is_cash_ticker(ticker):
-        return 1.0
-
-    if ticker in _run_price_cache:
-        return _run_price_cache[ticker]
-
-    periods = [preferred_period, "1D", "7D", "1M", "1Y", "ALL"]
-    for period in dict.fromkeys(period for period in periods if period):
-        price = _latest_close(_run_hist_cache.get((ticker, period)))
-        if price is not None:
-            _run_price_cache[ticker] = price
-            return price
-
-    price = get_live_price(ticker)
-    _run_price_cache[ticker] = price
-    return price
-
-def get_cached_usdtwd_rate():
-    global _run_usdtwd_rate
-    if _run_usdtwd_rate is None:
-        _run_usdtwd_rate = get_usdtwd_rate()
-    return _run_usdtwd_rate
-
-def calculate_holding_profit(item, live_price):
-    shares = item_shares(item)
-    if is_cash_ticker(item.get("ticker")):
-        return (shares, 0.0) if shares > 0 else (None, None)
-
-    avg_cost = _to_float(item.get('avg_cost', 0.0))
-    if shares > 0 and live_price is not None:
-        total_cost = avg_cost * shares
-        current_val = live_price * shares
-        if total_cost <= 0:
-            return current_val, None
-        profit = current_val - total_cost
-        pct = (profit / total_cost) * 100
-        return current_val, pct # Return total value and profit percentage
-    return None, None
-
 def render_stars(rating):
     filled = rating
     empty = 5 - rating
@@ -682,6 +713,14 @@ def get_tag_color(tag_name):
     # Use HSL for a dark background (saturation 50-70%, lightness 20-30%)
     return f"hsl({hue}, 60%, 25%)"
 
+def tag_colors_version():
+    """Part of every fragment-cache key that contains tag badges; changes when a tag color is edited."""
+    custom_colors = st.session_state.get('settings', {}).get("tag_colors", {})
+    return hash(json.dumps(custom_colors, sort_keys=True))
+
+def item_fingerprint(item):
+    return hash(json.dumps(item, sort_keys=True, ensure_ascii=False, default=str))
+
 def render_tags_html(tags):
     tags_html = ""
     for tag in tags:
@@ -701,6 +740,56 @@ def render_links(item):
         <a href="{tv_url}" target="_blank" class="crypto-link">☁️ TradingView TV</a>
     """
 
+def render_portfolio_summary():
+    metrics = get_metrics("1D")
+    summary = portfolio.summarize(metrics)
+    total_value = summary["total_value"]
+    cash_value = summary["cash_value"]
+    total_cost = summary["total_cost"]
+    total_profit = summary["total_profit"]
+    total_pct = summary["total_pct"]
+
+    p_color_val = "#FF3D00" if total_profit >= 0 else "#00C853"
+    sign_val = "+" if total_profit >= 0 else ""
+
+    st.markdown(f"""
+    <div style='background-color:#1E1E1E; padding:15px; border-radius:10px; border-left:4px solid {p_color_val};'>
+        <div style='color:grey; font-size:0.9rem;'>Total Value (NTD)</div>
+        <div style='font-size:1.8rem; font-weight:bold; color:white;'>NT${total_value:,.0f}</div>
+        <div style='color:#7DD3FC; font-size:0.85rem; margin-top:2px;'>持有現金: NT${cash_value:,.0f}</div>
+        <div style='color:grey; font-size:0.9rem; margin-top:10px;'>Total Profit</div>
+        <div style='font-size:1.2rem; font-weight:bold; color:{p_color_val};'>{sign_val}NT${total_profit:,.0f} ({sign_val}{total_pct:.2f}%)</div>
+        <div style='color:grey; font-size:0.8rem; margin-top:5px;'>Cost: NT${total_cost:,.0f}</div>
+        {render_market_breakdown_html(portfolio.market_breakdown(metrics))}
+    </div>
+    """, unsafe_allow_html=True)
+
+MARKET_LABELS = {"tw": "台股", "us": "美股", "jp": "日股", "hk": "港股", "crypto": "加密貨幣", "cash": "現金"}
+
+def render_market_breakdown_html(breakdown):
+    if len(breakdown) <= 1:
+        return ""
+    rows = ""
+    for market, row in breakdown.iterrows():
+        pnl_html = ""
+        if pd.notna(row["pnl_twd"]):
+            p_color = "#FF3D00" if row["pnl_twd"] >= 0 else "#00C853"
+            pnl_html = f"<span style='color:{p_color};'>{row['pnl_twd']:+,.0f}</span>"
+        rows += (
+            f"<div style='display:flex; justify-content:space-between; gap:6px;'>"
+            f"<span style='color:{get_market_color(market)};'>{MARKET_LABELS.get(market, market)} {row['weight']:.0f}%</span>"
+            f"<span>NT${row['value_twd']:,.0f} {pnl_html}</span></div>"
+        )
+    return f"<div style='color:#BBB; font-size:0.8rem; margin-top:10px; border-top:1px solid #333; padding-top:6px;'>{rows}</div>"
+
+@st.fragment(run_every=PENDING_POLL_SECONDS)
+def render_pending_portfolio_summary(summary_tickers):
+    """持倉報價還在背景載入時，先用已到的價格計算；全部到齊後整頁重跑一次，停止輪詢。"""
+    if all(is_market_data_ready(ticker) for ticker in summary_tickers):
+        st.rerun()
+    render_portfolio_summary()
+    st.caption("Loading quotes…")
+
 # --- Fragment: 及時資料顯示區塊 ---
 @st.fragment
 def render_live_data(item, period):
@@ -713,29 +802,63 @@ def render_live_data(item, period):
         )
         return
 
-    hist = get_cached_hist_data(ticker, period)
-    live_p = get_cached_live_price(ticker, preferred_period=period)
-    curr_sym = "<span class='curr-sym'>NT$</span>" if get_market_type(ticker) == "tw" else "<span class='curr-sym'>US$</span>"
-    
+    if not is_market_data_ready(ticker, period):
+        render_pending_live_data(item, period)
+        return
+
+    _render_live_data(item, period, get_cached_hist_data(ticker, period))
+
+@st.fragment(run_every=PENDING_POLL_SECONDS)
+def render_pending_live_data(item, period):
+    """
+    背景 worker 還在載入資料：先顯示 placeholder，每隔幾秒檢查一次。
+    資料到了就整頁重跑一次，改由不輪詢的 render_live_data 顯示，這個 fragment 的計時也隨之停止。
+    """
+    if is_market_data_ready(item['ticker'], period):
+        st.rerun()
+    st.markdown(LOADING_HTML, unsafe_allow_html=True)
+
+def _render_live_data(item, period, hist):
+    ticker = item['ticker']
+    metrics = get_metrics(period)
+    values = tuple(
+        portfolio.metric_value(metrics, ticker, col)
+        for col in ("last_price", "change", "change_pct", "value", "pnl_pct")
+    )
+    curr_sym = currency_html(item)
+    # 最後一根 K 棒會原地更新，所以 key 同時帶時間與收盤價
+    last_bar = (hist.index[-1], hist['Close'].iat[-1], len(hist)) if not hist.empty else None
+    signals = indicator_values(ticker)
+    combined_html, chart_img, holding_html = get_fragment_cache().get_or_build(
+        ("live", ticker, period, last_bar, values, signals, curr_sym),
+        lambda: build_live_data_html(hist, values, curr_sym, signals),
+    )
+
+    if chart_img:
+        st.markdown(combined_html, unsafe_allow_html=True)
+        if st.button("🔍", key=f"zoom_{ticker}"):
+             show_chart_dialog(ticker, period)
+        st.markdown(chart_img + holding_html, unsafe_allow_html=True)
+    else:
+        st.markdown(combined_html + holding_html, unsafe_allow_html=True)
+
+def build_live_data_html(hist, values, curr_sym, signals):
+    """(price html, sparkline svg or None, holding + indicator html) for one card."""
+    live_p, change, pct, val, p_pct = values
     price_html = "<div style='color:grey'>No Data</div>"
     chart_img = None
     
-    if live_p is not None and not hist.empty:
-        # Find previous close or start of period for change calculation
-        # For 1D, we compare to the first data point of the day
+    if change is not None and not hist.empty:
+        # 漲跌幅以週期第一根 K 棒為基準（1D 即當天第一筆），由 metrics table 預先算好
         if len(hist) > 0:
-            prev = hist['Close'].iloc[0]
-            change = live_p - prev
-            pct = (change / prev) * 100 if prev > 0 else 0
+            pct = pct or 0
             
             color_class = "change-pos" if change >= 0 else "change-neg"
             price_html = f"<div><span class='price-text'>{curr_sym}{live_p:.2f}</span><span class='{color_class}' style='margin-left:8px;'>{change:+.2f} ({pct:+.2f}%)</span></div>"
             
             # chart
-            history_list = hist['Close'].dropna().tolist()
-            if len(history_list) > 1:
-                line_color = '#FF3D00' if change >= 0 else '#00C853'
-                chart_img = create_sparkline(history_list, color=line_color)
+            line_color = '#FF3D00' if change >= 0 else '#00C853'
+            chart_img = create_sparkline(hist['Close'].to_numpy(), color=line_color)
                 
     # Build all HTML in one pass to minimize st.markdown calls
     combined_html = price_html
@@ -743,7 +866,6 @@ def render_live_data(item, period):
     if chart_img:
         combined_html += '<span class="zoom-btn-anchor"></span>'
 
-    val, p_pct = calculate_holding_profit(item, live_p)
     holding_html = ""
     if val is not None:
         if p_pct is None:
@@ -752,29 +874,81 @@ def render_live_data(item, period):
             p_color = "change-pos" if p_pct >= 0 else "change-neg"
             holding_html = f"<div class='holding-profit'>Total Value: <span class='{p_color}'>{curr_sym}{val:,.2f} ({p_pct:+.2f}%)</span></div>"
 
-    if chart_img:
-        st.markdown(combined_html, unsafe_allow_html=True)
-        if st.button("🔍", key=f"zoom_{ticker}"):
-             show_chart_dialog(ticker, period)
-        st.markdown(chart_img + holding_html, unsafe_allow_html=True)
-    else:
-        st.markdown(combined_html + holding_html, unsafe_allow_html=True)
+    holding_html += build_indicator_html(signals)
+    return combined_html, chart_img, holding_html
         
+CHART_MAX_POINTS = 1200  # 約等於 large dialog 寬度的像素數
+CHART_WEBGL_THRESHOLD = 800
+CHART_MAX_CANDLES = 240  # K 棒太密就看不出形狀，超過時合併相鄰 K 棒
+CHART_MODES = ["Line", "Candles"]
+
+def build_chart_figure(df):
+    """Close line for the Chart Explorer, min/max-downsampled to the viewport; dense series render with WebGL."""
+    closes = df['Close'].to_numpy(dtype=float)
+    valid = ~np.isnan(closes)
+    x = df.index[valid]
+    y = closes[valid]
+    index = downsample_minmax(y, CHART_MAX_POINTS // 2)
+    trace = go.Scattergl if len(index) > CHART_WEBGL_THRESHOLD else go.Scatter
+    fig = go.Figure(data=trace(x=x[index], y=y[index], mode='lines', line=dict(color='#4da6ff')))
+    fig.update_layout(
+        margin=dict(l=0, r=0, t=10, b=0),
+        yaxis=dict(side='right', autorange=True, fixedrange=False, rangemode='normal'),
+        xaxis=dict(autorange=True),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        dragmode='pan'
+    )
+    return fig
+
+def build_candlestick_figure(df):
+    """Candlesticks plus a volume pane from the cached OHLCV frame; dense frames are merged bucket by bucket."""
+    bars = md.bucket_ohlcv(df, CHART_MAX_CANDLES)
+    has_volume = "Volume" in bars.columns and bars["Volume"].fillna(0).gt(0).any()
+    fig = make_subplots(
+        rows=2 if has_volume else 1, cols=1, shared_xaxes=True,
+        row_heights=[0.75, 0.25] if has_volume else [1.0], vertical_spacing=0.03,
+    )
+    fig.add_trace(
+        go.Candlestick(
+            x=bars.index, open=bars['Open'], high=bars['High'], low=bars['Low'], close=bars['Close'],
+            increasing_line_color='#FF3D00', decreasing_line_color='#00C853', showlegend=False,
+        ),
+        row=1, col=1,
+    )
+    if has_volume:
+        colors = np.where(bars['Close'].to_numpy() >= bars['Open'].to_numpy(), '#FF3D00', '#00C853')
+        fig.add_trace(go.Bar(x=bars.index, y=bars['Volume'], marker_color=colors, showlegend=False), row=2, col=1)
+    fig.update_layout(
+        margin=dict(l=0, r=0, t=10, b=0),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        dragmode='pan',
+        xaxis_rangeslider_visible=False,
+    )
+    fig.update_yaxes(side='right', autorange=True, fixedrange=False)
+    return fig
+
 @st.dialog("Chart Explorer", width="large")
 def show_chart_dialog(ticker, period):
     st.subheader(f"{ticker} - Chart")
     
     current_p = st.session_state.get(f"period_{ticker}_dialog", period)
+    mode = st.segmented_control(
+        "Chart Mode", CHART_MODES, default=CHART_MODES[0], key=f"chart_mode_{ticker}_dialog",
+        label_visibility="collapsed",
+    ) or CHART_MODES[0]
     df = get_cached_hist_data(ticker, current_p)
+    if mode == "Candles" and not {'Open', 'High', 'Low'}.issubset(df.columns):
+        mode = "Line"
     if not df.empty:
-        fig = go.Figure(data=go.Scatter(x=df.index, y=df['Close'], mode='lines', line=dict(color='#4da6ff')))
-        fig.update_layout(
-            margin=dict(l=0, r=0, t=10, b=0),
-            yaxis=dict(side='right', autorange=True, fixedrange=False, rangemode='normal'),
-            xaxis=dict(autorange=True),
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            dragmode='pan'
+        last_bar = (df.index[-1], df['Close'].iat[-1], len(df))
+        build = build_candlestick_figure if mode == "Candles" else build_chart_figure
+        # 快取 go.Figure 而不是 to_json()/to_dict()：st.plotly_chart 收到 dict 會重新建立並驗證整個 Figure，
+        # 比直接序列化已建好的 Figure 慢一個數量級；序列化本身（每次數毫秒）由 st.plotly_chart 負責
+        fig = get_fragment_cache().get_or_build(
+            ("chart", ticker, current_p, mode, last_bar),
+            lambda: build(df),
         )
         st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
     else:
@@ -843,9 +1017,16 @@ def show_edit_dialog(ticker):
         if is_cash:
             n_yurl = ""
             n_tvurl = ""
+            n_currency = ""
         else:
             n_yurl = st.text_input("Yahoo URL (Optional)", value=item.get("yahoo_url", ""))
             n_tvurl = st.text_input("TradingView URL (Optional)", value=item.get("tradingview_url", ""))
+            n_currency = st.text_input(
+                "Currency (Optional)",
+                value=item.get("currency", ""),
+                placeholder=portfolio.infer_currency(ticker),
+                help="Leave empty to infer from the ticker suffix (.TW → TWD, .T → JPY, .HK → HKD, otherwise USD).",
+            ).strip().upper()
 
         c_save, c_del = st.columns([0.7, 0.3])
         with c_save:
@@ -856,10 +1037,11 @@ def show_edit_dialog(ticker):
     if submitted:
         wm.update_ticker_data(
             ticker, item.get("note", ""), n_rating,
-            n_yurl, n_tvurl, n_avg, n_sh, n_tags, n_custom
+            n_yurl, n_tvurl, n_avg, n_sh, n_tags, n_custom, currency=n_currency
         )
         item.update({
             "custom_name": n_custom,
+            "currency": n_currency,
             "rating": n_rating,
             "yahoo_url": n_yurl,
             "tradingview_url": n_tvurl,
@@ -925,16 +1107,11 @@ def render_card(item, i, j):
         # Title row
         c1, c2, c3 = st.columns([0.7, 0.15, 0.15])
         with c1:
-            display_name = wm.get_display_name(ticker, item_data=item)
-            stars_html = render_stars(item.get('rating', 0))
-            tags_html = render_tags_html(item.get('tags', []))
-            st.markdown(
-                f"<div style='border-left: 4px solid {mcolor}; padding-left: 8px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;'>"
-                f"<span style='font-weight:bold; font-size:1.6rem; color:white;'>{display_name}</span> "
-                f"<span style='font-size:0.9rem;color:grey;'>{ticker}</span></div>"
-                f"{stars_html}{tags_html}",
-                unsafe_allow_html=True
+            header_html = get_fragment_cache().get_or_build(
+                ("card_header", ticker, item_fingerprint(item), tag_colors_version()),
+                lambda: build_card_header_html(item, mcolor),
             )
+            st.markdown(header_html, unsafe_allow_html=True)
         with c2:
             render_note_popover(item, f"card_{i}_{j}")
         with c3:
@@ -956,6 +1133,18 @@ def render_card(item, i, j):
              
         st.markdown(render_links(item), unsafe_allow_html=True)
 
+def build_card_header_html(item, mcolor):
+    ticker = item['ticker']
+    display_name = wm.get_display_name(ticker, item_data=item)
+    stars_html = render_stars(item.get('rating', 0))
+    tags_html = render_tags_html(item.get('tags', []))
+    return (
+        f"<div style='border-left: 4px solid {mcolor}; padding-left: 8px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;'>"
+        f"<span style='font-weight:bold; font-size:1.6rem; color:white;'>{display_name}</span> "
+        f"<span style='font-size:0.9rem;color:grey;'>{ticker}</span></div>"
+        f"{stars_html}{tags_html}"
+    )
+
 @st.fragment
 def render_list_item(item):
     ticker = item['ticker']
@@ -984,23 +1173,69 @@ def render_list_item(item):
         st.markdown("<hr style='margin: 0.5em 0; border-color: #333;'>", unsafe_allow_html=True)
         return
 
-    hist = get_cached_hist_data(ticker, "1D")
-    live_p = get_cached_live_price(ticker, preferred_period="1D")
-    curr_sym = "<span class='curr-sym'>NT$</span>" if get_market_type(ticker) == "tw" else "<span class='curr-sym'>US$</span>"
+    if not is_market_data_ready(ticker, "1D"):
+        render_pending_list_item(item)
+        return
+
+    _render_list_row(item, get_cached_hist_data(ticker, "1D"))
+
+@st.fragment(run_every=PENDING_POLL_SECONDS)
+def render_pending_list_item(item):
+    """List View 的 placeholder 列：資料到了就整頁重跑一次，換成不輪詢的完整內容。"""
+    if is_market_data_ready(item['ticker'], "1D"):
+        st.rerun()
+    _render_list_row(item)
+
+def _render_list_row(item, hist=None):
+    """hist 為 None 代表資料仍在載入中。"""
+    ticker = item['ticker']
+    metrics = get_metrics("1D")
+    values = tuple(
+        portfolio.metric_value(metrics, ticker, col)
+        for col in ("last_price", "change", "change_pct", "value", "pnl_pct")
+    )
+    state = "loading" if hist is None else ("empty" if hist.empty else "ready")
+    signals = indicator_values(ticker)
+    name_html, price_html, change_html, profit_html, rating_html, tags_html, links_html, signals_html = get_fragment_cache().get_or_build(
+        ("list_row", ticker, item_fingerprint(item), tag_colors_version(), state, values, signals),
+        lambda: build_list_row_html(item, state, values, signals),
+    )
+
+    cc = st.columns([0.15, 0.12, 0.12, 0.12, 0.1, 0.1, 0.08, 0.1, 0.11])
+    cc[0].markdown(name_html, unsafe_allow_html=True)
+    cc[1].markdown(price_html, unsafe_allow_html=True)
+    cc[2].markdown(change_html, unsafe_allow_html=True)
+    cc[3].markdown(profit_html, unsafe_allow_html=True)
+    cc[4].markdown(rating_html, unsafe_allow_html=True)
+    cc[5].markdown(tags_html, unsafe_allow_html=True)
+    with cc[6]:
+        c_p1, c_p2 = st.columns(2)
+        with c_p1:
+            render_note_popover(item, f"list_{ticker}")
+        with c_p2:
+            render_edit_popover(item, f"list_{ticker}")
+    cc[7].markdown(links_html, unsafe_allow_html=True)
+    cc[8].markdown(signals_html, unsafe_allow_html=True)
+    st.markdown("<hr style='margin: 0.5em 0; border-color: #333;'>", unsafe_allow_html=True)
+
+def build_list_row_html(item, state, values, signals):
+    """HTML for each List View column; state is "loading", "empty" or "ready"."""
+    ticker = item['ticker']
+    live_p, chg, pct, val, p_pct = values
+    name = wm.get_display_name(ticker, item_data=item)
+    curr_sym = currency_html(item)
+    loading = state == "loading"
     
     # Formats
-    price_str = f"{curr_sym}{live_p:.2f}" if live_p else "N/A"
-    change_html = "-"
-    if live_p is not None and not hist.empty and len(hist)>0:
-        prev = hist['Close'].iloc[0]
-        chg = live_p - prev
-        pct = (chg/prev)*100 if prev>0 else 0
+    price_str = "…" if loading else (f"{curr_sym}{live_p:.2f}" if live_p else "N/A")
+    change_html = "…" if loading else "-"
+    if chg is not None and state == "ready":
+        pct = pct or 0
         color = "#FF3D00" if chg >= 0 else "#00C853"
         sign = "+" if chg >= 0 else ""
         change_html = f"<span style='color:{color}; font-weight:bold;'>{sign}{chg:.2f} ({sign}{pct:.2f}%)</span>"
         
-    val, p_pct = calculate_holding_profit(item, live_p)
-    profit_html = "-"
+    profit_html = "…" if loading and is_held_item(item) else "-"
     if val is not None:
         if p_pct is None:
             profit_html = f"<span style='font-weight:bold;'>{curr_sym}{val:,.2f}</span>"
@@ -1019,21 +1254,16 @@ def render_list_item(item):
     
     market_col = get_market_color(get_market_type(ticker))
     
-    cc = st.columns([0.15, 0.12, 0.12, 0.12, 0.1, 0.1, 0.08, 0.1, 0.11])
-    cc[0].markdown(f"<div style='border-left: 4px solid {market_col}; padding-left: 8px;'><b style='font-size:1.1rem;'>{ticker}</b><br><span style='color:#888; font-size:0.85rem;'>{name}</span></div>", unsafe_allow_html=True)
-    cc[1].markdown(f"<span style='font-size:1.1rem;'>{price_str}</span>", unsafe_allow_html=True)
-    cc[2].markdown(change_html, unsafe_allow_html=True)
-    cc[3].markdown(profit_html, unsafe_allow_html=True)
-    cc[4].markdown(f"<div style='margin-top:5px;'>{rating_str}</div>", unsafe_allow_html=True)
-    cc[5].markdown(f"<div style='margin-top:4px;'>{tags_html}</div>", unsafe_allow_html=True)
-    with cc[6]:
-        c_p1, c_p2 = st.columns(2)
-        with c_p1:
-            render_note_popover(item, f"list_{ticker}")
-        with c_p2:
-            render_edit_popover(item, f"list_{ticker}")
-    cc[7].markdown(links_html, unsafe_allow_html=True)
-    st.markdown("<hr style='margin: 0.5em 0; border-color: #333;'>", unsafe_allow_html=True)
+    return (
+        f"<div style='border-left: 4px solid {market_col}; padding-left: 8px;'><b style='font-size:1.1rem;'>{ticker}</b><br><span style='color:#888; font-size:0.85rem;'>{name}</span></div>",
+        f"<span style='font-size:1.1rem;'>{price_str}</span>",
+        change_html,
+        profit_html,
+        f"<div style='margin-top:5px;'>{rating_str}</div>",
+        f"<div style='margin-top:4px;'>{tags_html}</div>",
+        links_html,
+        build_indicator_html(signals, compact=True),
+    )
 
 
 @st.dialog("Search & Add Ticker")
@@ -1056,11 +1286,27 @@ def add_ticker_dialog():
 # 移除 Reorder 對話框，改用下拉選單排序 (見主程式區)
 
 # --- 主程式狀態寫入 ---
+@st.fragment(run_every=3)
+def watch_watchlist_revalidation(version):
+    """
+    背景正在向 Google Sheets 重新驗證 watchlist；遠端資料不同時整頁重跑以換上新資料。
+    驗證結束但內容沒變時也重跑一次，頁面不再掛著這個 fragment，輪詢隨之停止。
+    """
+    repository = wm.get_watchlist_repository()
+    if repository.version != version or not repository.revalidating:
+        st.rerun()
+
 force_remote_watchlist = st.session_state.pop("force_remote_watchlist", False)
-data = wm.load_watchlist_from_remote() if force_remote_watchlist else wm.load_watchlist()
+watchlist_repository = wm.get_watchlist_repository()
+data, watchlist_version = watchlist_repository.snapshot(force_remote=force_remote_watchlist)
+if watchlist_repository.revalidating:
+    watch_watchlist_revalidation(watchlist_version)
 connection_warning = wm.get_connection_warning()
 if connection_warning:
     st.warning(connection_warning)
+pending_writes, pending_write_error = wm.get_pending_write_status()
+if pending_writes and pending_write_error:
+    st.caption(f"⏳ {pending_writes} watchlist edit(s) saved locally, still syncing to Google Sheets (retrying).")
 
 # After loading check if migration happened
 if isinstance(data, dict):
@@ -1089,19 +1335,21 @@ if 'ticker_search_input' not in st.session_state:
 _ = load_settings()
 display_data = [item for item in data if not is_cash_ticker(item.get("ticker"))]
 
-valid_type_filters = {"tw", "us", "crypto"}
+valid_type_filters = {"tw", "us", "jp", "hk", "crypto"}
 st.session_state.active_type_filter = [
     mtype for mtype in st.session_state.active_type_filter
     if mtype in valid_type_filters
 ]
 
+prime_canonical_series(
+    [item["ticker"] for item in display_data] + get_fx_symbols(data),
+    st.session_state.get("refresh_interval", st.session_state.settings.get("refresh_interval", 60)),
+)
+
 # Sidebar: Group Management & Search
-summary_tickers = [
-    item["ticker"]
-    for item in display_data
-    if is_held_item(item)
-]
-prime_hist_data(summary_tickers, "1D")
+held_items = [item for item in display_data if is_held_item(item)]
+summary_tickers = [item["ticker"] for item in held_items] + get_fx_symbols(held_items)
+request_market_data(summary_tickers)
 
 with st.sidebar:
     st.header("🧭 功能導覽")
@@ -1137,64 +1385,19 @@ with st.sidebar:
 
     if st.session_state.nav_page == "📈 投資儀表板":
         st.header(" Portfolio Summary")
-    
-        total_cost = 0.0
-        total_value = 0.0
-        cash_value = 0.0
-        profit_basis_value = 0.0
-        usdtwd = get_cached_usdtwd_rate()
-    
-        for item in data:
-            shares = item_shares(item)
-            if shares <= 0:
-                continue
-
-            if is_cash_ticker(item.get("ticker")):
-                cash_value += shares
-                total_value += shares
-                continue
-
-            live_p = get_cached_live_price(item['ticker'], preferred_period="1D")
-            avg_cost = _to_float(item.get('avg_cost', 0.0))
-            if live_p is not None:
-                item_cost = avg_cost * shares
-                item_value = live_p * shares
-            
-                # Convert to TWD (if it's US or Crypto)
-                if get_market_type(item['ticker']) in ["us", "crypto"]:
-                    item_cost *= usdtwd
-                    item_value *= usdtwd
-                
-                total_value += item_value
-                if avg_cost > 0:
-                    total_cost += item_cost
-                    profit_basis_value += item_value
-                
-        total_profit = profit_basis_value - total_cost
-        total_pct = (total_profit / total_cost * 100) if total_cost > 0 else 0
-    
-        p_color_val = "#FF3D00" if total_profit >= 0 else "#00C853"
-        sign_val = "+" if total_profit >= 0 else ""
-    
-        st.markdown(f"""
-        <div style='background-color:#1E1E1E; padding:15px; border-radius:10px; border-left:4px solid {p_color_val};'>
-            <div style='color:grey; font-size:0.9rem;'>Total Value (NTD)</div>
-            <div style='font-size:1.8rem; font-weight:bold; color:white;'>NT${total_value:,.0f}</div>
-            <div style='color:#7DD3FC; font-size:0.85rem; margin-top:2px;'>持有現金: NT${cash_value:,.0f}</div>
-            <div style='color:grey; font-size:0.9rem; margin-top:10px;'>Total Profit</div>
-            <div style='font-size:1.2rem; font-weight:bold; color:{p_color_val};'>{sign_val}NT${total_profit:,.0f} ({sign_val}{total_pct:.2f}%)</div>
-            <div style='color:grey; font-size:0.8rem; margin-top:5px;'>Cost: NT${total_cost:,.0f}</div>
-        </div>
-        """, unsafe_allow_html=True)
+        if all(is_market_data_ready(ticker) for ticker in summary_tickers):
+            render_portfolio_summary()
+        else:
+            render_pending_portfolio_summary(summary_tickers)
     
     
         st.markdown("---")
     
         # --- Market Type Filter ---
         st.header("🌐 類型")
-        type_counts = {"tw": 0, "us": 0, "crypto": 0}
-        type_labels = {"tw": "🇹🇼 台股", "us": "🇺🇸 美股", "crypto": "🪙 加密貨幣"}
-        type_colors = {"tw": "#00C853", "us": "#FF3D00", "crypto": "#FFD600"}
+        type_counts = {"tw": 0, "us": 0, "jp": 0, "hk": 0, "crypto": 0}
+        type_labels = {"tw": "🇹🇼 台股", "us": "🇺🇸 美股", "jp": "🇯🇵 日股", "hk": "🇭🇰 港股", "crypto": "🪙 加密貨幣"}
+        type_colors = {mtype_key: get_market_color(mtype_key) for mtype_key in type_counts}
         for item in display_data:
             mtype = get_market_type(item['ticker'])
             if mtype in type_counts:
@@ -1236,7 +1439,7 @@ with st.sidebar:
                     st.session_state.active_type_filter.append(mtype_key)
                 st.rerun()
 
-        for mtype_key in ["tw", "us", "crypto"]:
+        for mtype_key in type_counts:
             if type_counts[mtype_key] > 0:
                 render_type_filter(mtype_key, type_labels[mtype_key], type_counts[mtype_key])
 
@@ -1562,7 +1765,8 @@ with c_sort:
         "30D Change (High > Low)", 
         "30D Change (Low > High)", 
         "Total Value (High > Low)", 
-        "Rating (High > Low)"
+        "Rating (High > Low)",
+        *INDICATOR_SORTS,
     ]
     if "sort_pref" not in st.session_state or st.session_state.sort_pref not in sort_opts:
         st.session_state.sort_pref = sort_opts[0]
@@ -1597,9 +1801,10 @@ with c_refresh:
         st.session_state.force_remote_watchlist = True
         wm.reset_supabase_client()
         wm.invalidate_watchlist_cache()
-        get_live_price.clear()
         get_hist_data.clear()
         get_hist_data_batch.clear()
+        get_intraday_data_batch.clear()
+        get_market_data_worker().request_refresh()
         st.rerun()
 
 with c_set:
@@ -1643,36 +1848,19 @@ with c_set:
 # --- 排序邏輯 ---
 def apply_sort(items, method):
     if method.startswith("Type (TW > US > Crypto"):
-        order_map = {"tw": 0, "us": 1, "crypto": 2}
+        order_map = {"tw": 0, "us": 1, "jp": 2, "hk": 3, "crypto": 4}
         return sorted(items, key=lambda x: order_map.get(get_market_type(x['ticker']), 99))
     elif method == "Rating (High > Low)":
         return sorted(items, key=lambda x: x.get('rating', 0), reverse=True)
     elif "Change" in method:
         period = "1D" if "1D" in method else "1M"
-        reverse = "High > Low" in method
-        
-        def get_chg(t):
-            hd = get_cached_hist_data(t, period)
-            hp = get_cached_live_price(t, preferred_period=period)
-            if hp is not None and not hd.empty and len(hd) > 0:
-                return (hp - hd['Close'].iloc[0]) / hd['Close'].iloc[0]
-            return -9999 if reverse else 9999
-            
-        return sorted(items, key=lambda x: get_chg(x['ticker']), reverse=reverse)
+        # 沒有資料（含尚在背景載入）的標的一律排在最後
+        return portfolio.sort_items(items, get_metrics(period), "change_pct", ascending="High > Low" not in method)
     elif method == "Total Value (High > Low)":
-        def get_val(item):
-            if is_cash_ticker(item.get('ticker')):
-                return get_cash_balance(item)
-            lp = get_cached_live_price(item['ticker'], preferred_period="1D")
-            shares = item_shares(item)
-            if lp is not None and shares > 0:
-                val = lp * shares
-                # Normalize to TWD for sorting
-                if get_market_type(item['ticker']) in ["us", "crypto"]:
-                    val *= get_cached_usdtwd_rate()
-                return val
-            return -1
-        return sorted(items, key=get_val, reverse=True)
+        return portfolio.sort_items(items, get_metrics("1D"), "value_twd", ascending=False)
+    elif method in INDICATOR_SORTS:
+        column, ascending = INDICATOR_SORTS[method]
+        return portfolio.sort_items(items, get_indicators(), column, ascending=ascending)
     return items
 
 @st.cache_data
@@ -1731,27 +1919,20 @@ def apply_filters(items):
 
     return filtered
 
-def prime_market_data_for_sort(items, sort_method):
-    tickers = [item["ticker"] for item in items]
-
-    if "Change" in sort_method:
-        sort_period = "1D" if "1D" in sort_method else "1M"
-        prime_hist_data(tickers, sort_period)
-    elif sort_method == "Total Value (High > Low)":
-        prime_hist_data(tickers, "1D")
-
 def prime_market_data_for_render(items, display_mode):
     tickers = [item["ticker"] for item in items]
+    request_market_data(tickers)
 
     if display_mode == "List View":
-        prime_hist_data(tickers, "1D")
+        prime_hist_data([ticker for ticker in tickers if is_market_data_ready(ticker, "1D")], "1D")
     else:
         period_groups = {}
         default_p = st.session_state.settings.get("default_period", "1M") if "settings" in st.session_state else "1M"
         for item in items:
             ticker = item["ticker"]
             period = st.session_state.get(f"period_{ticker}", default_p)
-            period_groups.setdefault(period, []).append(ticker)
+            if is_market_data_ready(ticker, period):
+                period_groups.setdefault(period, []).append(ticker)
         for period, period_tickers in period_groups.items():
             prime_hist_data(period_tickers, period)
 
@@ -1767,7 +1948,6 @@ def get_card_page_items(items):
 
 sort_method = st.session_state.get('sort_pref', "Type (TW > US > Crypto)")
 current_items = apply_filters(display_data)
-prime_market_data_for_sort(current_items, sort_method)
 current_items = apply_sort(current_items, sort_method)
 
 card_items = current_items
@@ -1900,6 +2080,7 @@ else:
             cols[5].markdown("**Tags**")
             cols[6].markdown("**Edit**")
             cols[7].markdown("**Links**")
+            cols[8].markdown("**Signals**")
             st.markdown("<hr style='margin: 0.5em 0; border-color: #333;'>", unsafe_allow_html=True)
             
             for item in current_items:
@@ -2,10 +2,11 @@ import argparse
 import json
 import sqlite3
 import time
-import urllib.request
 from datetime import datetime, timezone
 from pathlib import Path
 
+import requests
+
 
 DEFAULT_DB_PATH = Path("local_backups") / "investmenttool_backup.sqlite"
 DEFAULT_OUT_PATH = Path("local_backups") / "google_sheets_payload.json"
@@ -74,6 +75,7 @@ def load_payload(db_path):
                 "created_at": merged.get("created_at") or "",
                 "avg_cost": 1.0 if is_cash else float(merged.get("avg_cost") or 0),
                 "shares": float(merged.get("shares") or 0),
+                "currency": "" if is_cash else str(merged.get("currency") or "").strip().upper(),
             }
         )
 
@@ -92,6 +94,7 @@ def load_payload(db_path):
                 "created_at": datetime.now(timezone.utc).isoformat(),
                 "avg_cost": 1.0,
                 "shares": 0.0,
+                "currency": "",
             }
         )
 
@@ -124,22 +127,20 @@ def load_payload(db_path):
     }
 
 
-def post_payload(web_app_url, token, payload, retries=2):
+def post_payload(web_app_url, token, payload, retries=2, session=None):
     body = dict(payload)
     body["token"] = token
     data = json.dumps(body, ensure_ascii=False).encode("utf-8")
-    request = urllib.request.Request(
-        web_app_url,
-        data=data,
-        headers={"Content-Type": "application/json; charset=utf-8"},
-        method="POST",
-    )
+    # 重試沿用同一個 keep-alive session；Apps Script 不能解 gzip request body，只壓縮回應
+    session = session or requests.Session()
+    headers = {"Content-Type": "application/json; charset=utf-8", "Accept-Encoding": "gzip"}
 
     last_error = None
     for attempt in range(retries + 1):
         try:
-            with urllib.request.urlopen(request, timeout=60) as response:
-                return response.read().decode("utf-8")
+            response = session.post(web_app_url, data=data, headers=headers, timeout=60)
+            response.raise_for_status()
+            return response.content.decode("utf-8")
         except Exception as exc:
             last_error = exc
             if attempt < retries:
@@ -0,0 +1,33 @@
+import threading
+from collections import OrderedDict
+
+FRAGMENT_CACHE_SIZE = 1024
+
+
+class FragmentCache:
+    """
+    Bounded LRU of prebuilt HTML fragments (card headers, sparkline blocks, list rows),
+    shared by every session. Keys carry everything the fragment depends on, so an
+    unchanged card is a dictionary lookup and a changed one simply misses; the least
+    recently used entries are evicted past `max_entries`.
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # build 在鎖外執行；同一個 key 同時 miss 時最多重算一次，結果相同
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
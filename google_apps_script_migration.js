@@ -12,11 +12,18 @@ const TARGET_HEADERS = [
   "created_at",
   "avg_cost",
   "shares",
+  "currency",
+  "row_version",
 ];
 
 const CASH_TICKER = "CASH_TWD";
 const CASH_DISPLAY_NAME = "持有現金";
 const SETTINGS_HEADERS = ["refresh_interval", "tag_colors", "default_period"];
+const TARGETS_VERSION_PROPERTY = "TARGETS_VERSION";
+const LOCK_TIMEOUT_MS = 20000;
+const SCHEMA_MIGRATED_PROPERTY = "TARGETS_SCHEMA_MIGRATED";
+const CACHE_TTL_SECONDS = 300;
+const SETTINGS_CACHE_KEY = "settings";
 
 function doPost(e) {
   try {
@@ -27,22 +34,25 @@ function doPost(e) {
     let result;
 
     if (action === "import_all") {
-      result = importInvestmentToolData(payload);
+      result = withTargetsLock(() => importInvestmentToolData(payload));
     } else if (action === "load_watchlist") {
-      result = { items: loadWatchlist() };
+      result = { items: loadWatchlist(), version: getTargetsVersion() };
     } else if (action === "save_watchlist") {
-      result = saveWatchlist(payload.items || []);
+      result = withTargetsLock(() => saveWatchlist(payload.items || []));
+    } else if (action === "upsert_targets") {
+      result = withTargetsLock(() => upsertTargets(payload.items || [], payload.base_version));
+    } else if (action === "delete_targets") {
+      result = withTargetsLock(() => deleteTargets(payload.tickers || [], payload.base_version));
+    } else if (action === "reorder_targets") {
+      result = withTargetsLock(() => reorderTargets(payload.tickers || [], payload.base_version));
     } else if (action === "migrate_schema") {
       result = migrateSheetSchema();
     } else if (action === "load_settings") {
       result = { settings: loadSettings() };
     } else if (action === "save_settings") {
       result = saveSettings(payload.settings || {});
-    } else if (action === "load_all") {
-      result = {
-        items: loadWatchlist(),
-        settings: loadSettings(),
-      };
+    } else if (action === "bootstrap" || action === "load_all") {
+      result = bootstrap();
     } else {
       throw new Error("Unknown action: " + action);
     }
@@ -66,21 +76,35 @@ function assertAuthorized(payload) {
 
 function importInvestmentToolData(payload) {
   const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
+  const write = beginTargetsWrite();
   const targets = mergeTargetsWithAssets(payload.targets || [], payload.assets || []);
 
   writeTable(spreadsheet, "targets", TARGET_HEADERS, targets);
   writeTable(spreadsheet, "settings", SETTINGS_HEADERS, payload.settings || []);
+  PropertiesService.getScriptProperties().setProperty(SCHEMA_MIGRATED_PROPERTY, "1");
+  CacheService.getScriptCache().remove(SETTINGS_CACHE_KEY);
 
-  return {
+  return finishTargetsWrite(write, {
     targets: targets.length,
     assets_merged: (payload.assets || []).length,
     settings: (payload.settings || []).length,
-  };
+  });
 }
 
+// Reads are served from CacheService keyed by the targets version, so every write
+// (which bumps TARGETS_VERSION) invalidates them. Manual edits in the Sheets UI show up
+// once the entry expires (CACHE_TTL_SECONDS).
 function loadWatchlist() {
+  return cachedJson(watchlistCacheKey(getTargetsVersion()), readWatchlist);
+}
+
+function watchlistCacheKey(version) {
+  return "watchlist:" + version;
+}
+
+function readWatchlist() {
   const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
-  const targets = loadMergedTargets(spreadsheet);
+  const targets = loadTargetRows(spreadsheet);
 
   return targets
     .map((target) => {
@@ -101,16 +125,28 @@ function loadWatchlist() {
         avg_cost: avgCost,
         shares,
         holding: shares > 0,
+        currency: cleanString(target.currency).toUpperCase(),
       };
     })
     .filter((item) => item.ticker)
     .sort((a, b) => a.display_order - b.display_order || a.ticker.localeCompare(b.ticker));
 }
 
+// Everything the app needs on a cold start in one round trip (one Apps Script spin-up
+// instead of separate load_watchlist and load_settings calls).
+function bootstrap() {
+  return {
+    items: loadWatchlist(),
+    settings: loadSettings(),
+    version: getTargetsVersion(),
+  };
+}
+
 function migrateSheetSchema() {
   const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
   const targets = loadMergedTargets(spreadsheet);
   removeSheetIfPresent(spreadsheet, "assets");
+  PropertiesService.getScriptProperties().setProperty(SCHEMA_MIGRATED_PROPERTY, "1");
   return {
     targets: targets.length,
     cash_row: targets.some((target) => isCashTicker(target.ticker)),
@@ -118,11 +154,8 @@ function migrateSheetSchema() {
   };
 }
 
-function saveWatchlist(items) {
-  const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
-  const now = new Date().toISOString();
-
-  const targets = items.map((item, index) => ({
+function toTargetRow(item, displayOrder, now) {
+  return {
     ticker: cleanString(item.ticker),
     custom_name: cleanString(item.custom_name),
     note: cleanString(item.note),
@@ -130,16 +163,203 @@ function saveWatchlist(items) {
     yahoo_url: cleanString(item.yahoo_url),
     tradingview_url: cleanString(item.tradingview_url),
     tags: stringifyTags(item.tags),
-    display_order: index,
+    display_order: displayOrder,
     created_at: cleanString(item.created_at) || now,
     avg_cost: toNumber(item.avg_cost, isCashTicker(item.ticker) ? 1 : 0),
     shares: toNumber(item.shares),
-  })).filter((item) => item.ticker);
+    currency: isCashTicker(item.ticker) ? "" : cleanString(item.currency).toUpperCase(),
+  };
+}
+
+function saveWatchlist(items) {
+  const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
+  const write = beginTargetsWrite();
+  const now = new Date().toISOString();
+
+  const targets = items
+    .map((item, index) => ({ ...toTargetRow(item, index, now), row_version: write.next }))
+    .filter((item) => item.ticker);
 
   const normalizedTargets = ensureCashTargetRow(targets);
   writeTable(spreadsheet, "targets", TARGET_HEADERS, normalizedTargets);
 
-  return { targets: normalizedTargets.length };
+  return finishTargetsWrite(write, { targets: normalizedTargets.length });
+}
+
+// Optimistic concurrency: every write to the targets sheet bumps TARGETS_VERSION (script
+// properties) and stamps the rows it touches with row_version. Clients send the version they
+// last loaded as base_version; when it is behind, the write is still merged row by row and the
+// response says stale: true (plus the rows another client changed) so the client re-reads.
+function getTargetsVersion() {
+  return toInteger(PropertiesService.getScriptProperties().getProperty(TARGETS_VERSION_PROPERTY));
+}
+
+function beginTargetsWrite(baseVersion) {
+  const current = getTargetsVersion();
+  return {
+    current,
+    next: current + 1,
+    base: hasValue(baseVersion) ? toInteger(baseVersion) : current,
+  };
+}
+
+function finishTargetsWrite(write, result) {
+  PropertiesService.getScriptProperties().setProperty(TARGETS_VERSION_PROPERTY, String(write.next));
+  CacheService.getScriptCache().remove(watchlistCacheKey(write.current));
+  return { ...result, version: write.next, stale: write.base !== write.current };
+}
+
+function withTargetsLock(callback) {
+  const lock = LockService.getScriptLock();
+  lock.waitLock(LOCK_TIMEOUT_MS);
+  try {
+    return callback();
+  } finally {
+    lock.releaseLock();
+  }
+}
+
+// Row-level writes: only the touched rows (or the display_order column) are written,
+// instead of clearContents() + rewriting the whole targets sheet.
+function upsertTargets(items, baseVersion) {
+  const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
+  const write = beginTargetsWrite(baseVersion);
+  const { sheet, headers } = getTargetsSheet(spreadsheet);
+  const rowsByTicker = findTargetRows(sheet, headers);
+  const versionIndex = headers.indexOf("row_version");
+  const now = new Date().toISOString();
+  const appended = [];
+  const conflicts = [];
+  let updated = 0;
+
+  items.forEach((item) => {
+    const target = { ...toTargetRow(item, toInteger(item.display_order), now), row_version: write.next };
+    if (!target.ticker) {
+      return;
+    }
+
+    const row = rowsByTicker[target.ticker];
+    if (!row) {
+      appended.push(headers.map((header) => toCellValue(target[header])));
+      return;
+    }
+
+    if (toInteger(row.values[versionIndex]) > write.base) {
+      conflicts.push(target.ticker);
+    }
+    // Merge at field level: only the fields this client changed (_fields) are written, so a
+    // concurrent edit to another field of the same row survives. Without _fields the row is replaced.
+    const fields = Array.isArray(item._fields) ? item._fields.concat("row_version") : null;
+    const values = headers.map((header, index) => (
+      !fields || fields.indexOf(header) >= 0 ? toCellValue(target[header]) : row.values[index]
+    ));
+    sheet.getRange(row.rowNumber, 1, 1, headers.length).setValues([values]);
+    updated += 1;
+  });
+
+  if (appended.length) {
+    sheet.getRange(sheet.getLastRow() + 1, 1, appended.length, headers.length).setValues(appended);
+  }
+
+  return finishTargetsWrite(write, { updated, appended: appended.length, conflicts });
+}
+
+function deleteTargets(tickers, baseVersion) {
+  const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
+  const write = beginTargetsWrite(baseVersion);
+  const { sheet, headers } = getTargetsSheet(spreadsheet);
+  const rowsByTicker = findTargetRows(sheet, headers);
+  const versionIndex = headers.indexOf("row_version");
+
+  const rows = tickers
+    .map((ticker) => cleanString(ticker))
+    .filter((ticker) => ticker && !isCashTicker(ticker) && rowsByTicker[ticker])
+    .map((ticker) => rowsByTicker[ticker]);
+  const conflicts = rows
+    .filter((row) => toInteger(row.values[versionIndex]) > write.base)
+    .map((row) => cleanString(row.values[headers.indexOf("ticker")]));
+
+  // Delete from the bottom up so earlier row numbers stay valid.
+  rows
+    .map((row) => row.rowNumber)
+    .sort((a, b) => b - a)
+    .forEach((rowNumber) => sheet.deleteRow(rowNumber));
+  return finishTargetsWrite(write, { deleted: rows.length, conflicts });
+}
+
+// display_order is list-level state, so reordering bumps the sheet version but not row_version.
+function reorderTargets(tickers, baseVersion) {
+  const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
+  const write = beginTargetsWrite(baseVersion);
+  const { sheet, headers } = getTargetsSheet(spreadsheet);
+  const lastRow = sheet.getLastRow();
+  if (lastRow < 2) {
+    return finishTargetsWrite(write, { reordered: 0 });
+  }
+
+  const orderByTicker = {};
+  tickers.forEach((ticker, index) => {
+    orderByTicker[cleanString(ticker)] = index;
+  });
+
+  const tickerValues = sheet.getRange(2, headers.indexOf("ticker") + 1, lastRow - 1, 1).getValues();
+  const orderRange = sheet.getRange(2, headers.indexOf("display_order") + 1, lastRow - 1, 1);
+  const currentOrder = orderRange.getValues();
+  const values = tickerValues.map((row, index) => {
+    const ticker = cleanString(row[0]);
+    return [hasOwn(orderByTicker, ticker) ? orderByTicker[ticker] : currentOrder[index][0]];
+  });
+
+  orderRange.setValues(values);
+  return finishTargetsWrite(write, { reordered: tickers.length });
+}
+
+function getTargetsSheet(spreadsheet) {
+  const sheet = getOrCreateSheet(spreadsheet, "targets");
+  const lastColumn = sheet.getLastColumn();
+  const headers = lastColumn > 0
+    ? sheet.getRange(1, 1, 1, lastColumn).getValues()[0].map((header) => cleanString(header))
+    : [];
+
+  // Older sheets may miss newer columns (e.g. currency); append them to the header row.
+  const missing = TARGET_HEADERS.filter((header) => headers.indexOf(header) < 0);
+  if (missing.length) {
+    sheet.getRange(1, headers.length + 1, 1, missing.length).setValues([missing]);
+    headers.push(...missing);
+    sheet.setFrozenRows(1);
+  }
+
+  return { sheet, headers };
+}
+
+function findTargetRows(sheet, headers) {
+  const rowsByTicker = {};
+  const lastRow = sheet.getLastRow();
+  if (lastRow < 2) {
+    return rowsByTicker;
+  }
+
+  const tickerIndex = headers.indexOf("ticker");
+  sheet.getRange(2, 1, lastRow - 1, headers.length).getValues().forEach((values, index) => {
+    const ticker = cleanString(values[tickerIndex]);
+    if (ticker) {
+      rowsByTicker[ticker] = { rowNumber: index + 2, values };
+    }
+  });
+  return rowsByTicker;
+}
+
+// The legacy assets merge and rewrite check only run until the sheet has been migrated
+// once; after that the read path is a plain read of the targets sheet.
+function loadTargetRows(spreadsheet) {
+  const properties = PropertiesService.getScriptProperties();
+  if (properties.getProperty(SCHEMA_MIGRATED_PROPERTY)) {
+    return readTable(spreadsheet, "targets");
+  }
+
+  const targets = loadMergedTargets(spreadsheet);
+  properties.setProperty(SCHEMA_MIGRATED_PROPERTY, "1");
+  return targets;
 }
 
 function loadMergedTargets(spreadsheet) {
@@ -182,6 +402,8 @@ function mergeTargetsWithAssets(targets, assets) {
         created_at: cleanString(target.created_at),
         avg_cost: isCashTicker(ticker) && avgCost <= 0 ? 1 : avgCost,
         shares,
+        currency: cleanString(target.currency),
+        row_version: toInteger(target.row_version),
       };
     })
     .filter((target) => target.ticker);
@@ -227,6 +449,8 @@ function ensureCashTargetRow(targets) {
       created_at: now,
       avg_cost: 1,
       shares: 0,
+      currency: "",
+      row_version: 0,
     });
   }
 
@@ -249,6 +473,10 @@ function targetsNeedRewrite(originalTargets, mergedTargets) {
 }
 
 function loadSettings() {
+  return cachedJson(SETTINGS_CACHE_KEY, readSettings);
+}
+
+function readSettings() {
   const spreadsheet = SpreadsheetApp.openById(SPREADSHEET_ID);
   const rows = readTable(spreadsheet, "settings");
   const row = rows[0] || {};
@@ -268,9 +496,26 @@ function saveSettings(settings) {
   };
 
   writeTable(spreadsheet, "settings", SETTINGS_HEADERS, [row]);
+  CacheService.getScriptCache().remove(SETTINGS_CACHE_KEY);
   return { settings: 1 };
 }
 
+function cachedJson(key, loader) {
+  const cache = CacheService.getScriptCache();
+  const cached = cache.get(key);
+  if (cached) {
+    return JSON.parse(cached);
+  }
+
+  const value = loader();
+  try {
+    cache.put(key, JSON.stringify(value), CACHE_TTL_SECONDS);
+  } catch (error) {
+    // CacheService rejects values over 100KB; such reads just stay uncached.
+  }
+  return value;
+}
+
 function readTable(spreadsheet, sheetName) {
   const sheet = spreadsheet.getSheetByName(sheetName);
   if (!sheet || sheet.getLastRow() < 1 || sheet.getLastColumn() < 1) {
@@ -298,7 +543,7 @@ function writeTable(spreadsheet, sheetName, headers, rows) {
   sheet.clearContents();
 
   const values = [headers].concat(
-    rows.map((row) => headers.map((header) => row[header] === undefined || row[header] === null ? "" : row[header]))
+    rows.map((row) => headers.map((header) => toCellValue(row[header])))
   );
 
   sheet.getRange(1, 1, values.length, headers.length).setValues(values);
@@ -306,6 +551,10 @@ function writeTable(spreadsheet, sheetName, headers, rows) {
   sheet.autoResizeColumns(1, headers.length);
 }
 
+function toCellValue(value) {
+  return value === undefined || value === null ? "" : value;
+}
+
 function getOrCreateSheet(spreadsheet, sheetName) {
   return spreadsheet.getSheetByName(sheetName) || spreadsheet.insertSheet(sheetName);
 }
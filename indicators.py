@@ -0,0 +1,162 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+MA_WINDOWS = (20, 50, 200)
+RSI_PERIOD = 14
+BOLLINGER_WINDOW = 20
+BOLLINGER_STD = 2.0
+# 52 週區間以日期切，不用固定 K 棒數：加密貨幣一年約 365 根、股票約 252 根
+YEAR = pd.Timedelta(days=365)
+# 均線與布林通道需要的 K 棒數；tail 另外保留最近一年內的所有 K 棒
+TAIL_BARS = max(MA_WINDOWS + (BOLLINGER_WINDOW,))
+
+INDICATOR_COLUMNS = [
+    "ma20",
+    "ma50",
+    "ma200",
+    "ma20_gap_pct",
+    "ma50_gap_pct",
+    "ma200_gap_pct",
+    "rsi14",
+    "bb_upper",
+    "bb_lower",
+    "bb_pct",
+    "drawdown_pct",
+    "high_52w",
+    "low_52w",
+    "range_52w_pct",
+]
+
+
+def _epoch_ns(index):
+    return pd.DatetimeIndex(index).as_unit("ns").asi8
+
+
+class _SeriesState:
+    """Indicator state folded up to the last *closed* bar of one symbol's daily series."""
+
+    def __init__(self, closes):
+        values = closes.to_numpy(dtype=float)
+        self.last_index = closes.index[-1]
+        self.last_close = values[-1]
+        self.count = len(values)
+        self.tail, self.tail_ns = values, _epoch_ns(closes.index)
+        self._trim()
+        self.peak = values.max()
+        diffs = np.diff(values)
+        # Wilder smoothing is an EMA with alpha = 1 / period
+        smoothing = dict(alpha=1 / RSI_PERIOD, adjust=False)
+        self.avg_gain = pd.Series(np.clip(diffs, 0, None)).ewm(**smoothing).mean().iat[-1] if len(diffs) else 0.0
+        self.avg_loss = pd.Series(np.clip(-diffs, 0, None)).ewm(**smoothing).mean().iat[-1] if len(diffs) else 0.0
+
+    def fold(self, closes):
+        """Advance the state over bars that closed since `last_index` (a handful per refresh)."""
+        alpha = 1 / RSI_PERIOD
+        for value in closes.to_numpy(dtype=float):
+            diff = value - self.last_close
+            self.avg_gain += alpha * (max(diff, 0.0) - self.avg_gain)
+            self.avg_loss += alpha * (max(-diff, 0.0) - self.avg_loss)
+            self.peak = max(self.peak, value)
+            self.last_close = value
+        self.tail = np.concatenate((self.tail, closes.to_numpy(dtype=float)))
+        self.tail_ns = np.concatenate((self.tail_ns, _epoch_ns(closes.index)))
+        self._trim()
+        self.count += len(closes)
+        self.last_index = closes.index[-1]
+
+    def _trim(self):
+        # 保留均線需要的最後 TAIL_BARS 根，以及最近一年內的 K 棒（取兩者較長者）
+        year_start = np.searchsorted(self.tail_ns, self.tail_ns[-1] - YEAR.value)
+        start = min(max(len(self.tail) - TAIL_BARS, 0), year_start)
+        self.tail, self.tail_ns = self.tail[start:], self.tail_ns[start:]
+
+    def evaluate(self, close, timestamp):
+        """Indicators with the still-forming last bar applied on top, without mutating the state."""
+        window = np.append(self.tail, close)
+        result = {f"ma{w}": window[-w:].mean() if len(window) >= w else np.nan for w in MA_WINDOWS}
+        # 價格相對均線的距離（%），正值代表在均線之上
+        for w in MA_WINDOWS:
+            ma = result[f"ma{w}"]
+            result[f"ma{w}_gap_pct"] = (close / ma - 1) * 100 if ma > 0 else np.nan
+
+        if self.count >= RSI_PERIOD:
+            alpha = 1 / RSI_PERIOD
+            diff = close - self.last_close
+            gain = self.avg_gain + alpha * (max(diff, 0.0) - self.avg_gain)
+            loss = self.avg_loss + alpha * (max(-diff, 0.0) - self.avg_loss)
+            result["rsi14"] = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+        else:
+            result["rsi14"] = np.nan
+
+        if len(window) >= BOLLINGER_WINDOW:
+            band = window[-BOLLINGER_WINDOW:]
+            mid, std = band.mean(), band.std()
+            upper, lower = mid + BOLLINGER_STD * std, mid - BOLLINGER_STD * std
+            result.update(
+                bb_upper=upper,
+                bb_lower=lower,
+                bb_pct=(close - lower) / (upper - lower) * 100 if upper > lower else np.nan,
+            )
+        else:
+            result.update(bb_upper=np.nan, bb_lower=np.nan, bb_pct=np.nan)
+
+        year_start = np.searchsorted(self.tail_ns, _epoch_ns([timestamp])[0] - YEAR.value)
+        year = window[year_start:]
+        high, low = year.max(), year.min()
+        result.update(
+            drawdown_pct=(close / max(self.peak, close) - 1) * 100,
+            high_52w=high,
+            low_52w=low,
+            range_52w_pct=(close - low) / (high - low) * 100 if high > low else np.nan,
+        )
+        return result
+
+
+class IndicatorEngine:
+    """
+    Process-wide indicator state per symbol. The first call for a symbol folds its whole
+    daily series with vectorized NumPy/pandas; later calls only fold the bars that
+    closed since then, and the forming last bar is evaluated on top each time.
+    A series whose already-folded history changed (backfill, split adjustment) is rebuilt.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def compute(self, symbol, frame):
+        if frame is None or frame.empty or "Close" not in frame.columns:
+            return {}
+        closes = frame["Close"].dropna()
+        if len(closes) < 2:
+            return {}
+
+        closed, current, current_ts = closes.iloc[:-1], closes.iat[-1], closes.index[-1]
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is None or not self._can_extend(state, closed):
+                state = _SeriesState(closed)
+                self._states[symbol] = state
+            elif closed.index[-1] != state.last_index:
+                state.fold(closed.loc[closed.index > state.last_index])
+            return state.evaluate(current, current_ts)
+
+    @staticmethod
+    def _can_extend(state, closed):
+        if closed.index[-1] == state.last_index:
+            return closed.iat[-1] == state.last_close
+        if state.last_index not in closed.index or closed.index[-1] < state.last_index:
+            return False
+        if closed.at[state.last_index] != state.last_close:
+            return False
+        return (closed.index > state.last_index).sum() <= TAIL_BARS
+
+
+def build_table(engine, frames):
+    """Indicator table indexed by ticker from {ticker: (symbol, daily frame)}; unknown values stay NaN."""
+    rows = {ticker: engine.compute(symbol, frame) for ticker, (symbol, frame) in frames.items()}
+    table = pd.DataFrame.from_dict(rows, orient="index").reindex(index=list(frames), columns=INDICATOR_COLUMNS)
+    table.index.name = "ticker"
+    return table.astype(float)
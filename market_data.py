@@ -0,0 +1,565 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+# 所有週期都由兩條 canonical series 推導：5m 日內資料與 1d 日線資料
+CANONICAL_SERIES = {
+    "intraday": {"interval": "5m", "yf_period": "5d", "keep": "7D", "min_refresh_seconds": 10},
+    "daily": {"interval": "1d", "yf_period": "max", "keep": "ALL", "min_refresh_seconds": 60},
+}
+PERIOD_SOURCES = {'1D': 'intraday', '7D': 'intraday', '1M': 'daily', '1Y': 'daily', 'ALL': 'daily'}
+RESAMPLE_RULES = {'7D': '60min', '1Y': 'W-MON', 'ALL': 'MS'}
+OHLCV_AGG = {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Adj Close": "last", "Volume": "sum"}
+YF_PERIOD_RANK = {'1d': 0, '5d': 1, '1mo': 2, '1y': 3, 'max': 4}
+# yfinance rejects intraday requests that start further back than this.
+INTRADAY_MAX_AGE = {'5m': pd.Timedelta(days=59), '1h': pd.Timedelta(days=729)}
+READ_LOOKBACK = {
+    '1D': pd.Timedelta(days=5),
+    '7D': pd.Timedelta(days=14),
+    '1M': pd.DateOffset(months=1),
+    '1Y': pd.DateOffset(years=1),
+}
+SESSION_COUNTS = {'1D': 1, '7D': 5}
+# 自動刷新關閉（interval 0）時 worker 仍以這個間隔更新，使用者互動觸發的 rerun 才不會一直看到舊價格
+IDLE_REFRESH_SECONDS = 60
+# 增量刷新的 tail 請求最多往回抓這麼久；停牌等落後更久的標的不進一般請求，
+# 只每 LAGGING_RECHECK_SECONDS 檢查一次，恢復交易時整條重抓
+TAIL_MAX_AGE = {'5m': pd.Timedelta(days=7), '1d': pd.Timedelta(days=31)}
+LAGGING_RECHECK_SECONDS = 15 * 60
+# tail 起點落在同一個區間的標的共用一個請求（同一市場的標的通常停在同一根 K 棒）
+TAIL_GROUP_FREQ = {'5m': '1h', '1d': '1D'}
+# 重疊的已收盤 K 棒收盤價差超過這個比例，視為 Yahoo 改寫了歷史（分割、配息調整）
+RECONCILE_RTOL = 1e-3
+
+
+def normalize_hist_frame(df):
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.droplevel(0, axis=1)
+
+    if "Close" not in df.columns and "Adj Close" in df.columns:
+        df = df.copy()
+        df["Close"] = df["Adj Close"]
+
+    if "Close" not in df.columns:
+        return pd.DataFrame()
+
+    return df.dropna(subset=["Close"])
+
+
+def split_download(raw, symbols):
+    """Split a grouped `yf.download` result into one normalized frame per symbol."""
+    symbols = tuple(symbols)
+    results = {symbol: pd.DataFrame() for symbol in symbols}
+    if raw is None or raw.empty:
+        return results
+
+    if len(symbols) == 1:
+        results[symbols[0]] = normalize_hist_frame(raw)
+    elif isinstance(raw.columns, pd.MultiIndex):
+        level0 = set(raw.columns.get_level_values(0))
+        level1 = set(raw.columns.get_level_values(1))
+        for symbol in symbols:
+            try:
+                if symbol in level0:
+                    results[symbol] = normalize_hist_frame(raw[symbol])
+                elif symbol in level1:
+                    results[symbol] = normalize_hist_frame(raw.xs(symbol, axis=1, level=1))
+            except Exception:
+                results[symbol] = pd.DataFrame()
+    return results
+
+
+def download_history(symbols, interval, period=None, start=None):
+    symbols = tuple(dict.fromkeys(symbols))
+    if not symbols:
+        return {}
+
+    kwargs = {"start": start} if start is not None else {"period": period}
+    try:
+        raw = yf.download(
+            list(symbols),
+            interval=interval,
+            group_by="ticker",
+            threads=True,
+            progress=False,
+            auto_adjust=False,
+            **kwargs,
+        )
+    except Exception:
+        raw = pd.DataFrame()
+    return split_download(raw, symbols)
+
+
+def latest_close(df):
+    if df is None or df.empty or "Close" not in df.columns:
+        return None
+    close = df["Close"].dropna()
+    if close.empty:
+        return None
+    try:
+        return float(close.iloc[-1])
+    except Exception:
+        return None
+
+
+def slice_period(df, period):
+    """Trim a stored series to the window yfinance would return for `period`."""
+    if df is None or df.empty:
+        return pd.DataFrame()
+    if period in SESSION_COUNTS:
+        dates = df.index.normalize()
+        keep = dates.unique()[-SESSION_COUNTS[period]:]
+        return df[dates.isin(keep)]
+    if period in READ_LOOKBACK:
+        return df[df.index >= df.index[-1] - READ_LOOKBACK[period]]
+    return df
+
+
+def _store_covers(info, interval, yf_period):
+    if not info:
+        return False
+    if YF_PERIOD_RANK.get(info.get("period"), -1) < YF_PERIOD_RANK[yf_period]:
+        return False
+    max_age = INTRADAY_MAX_AGE.get(interval)
+    if max_age is not None:
+        last_ts = info["last_ts"]
+        now = pd.Timestamp(datetime.now(timezone.utc))
+        if last_ts.tzinfo is None:
+            now = now.tz_localize(None)
+        if now - last_ts > max_age:
+            return False
+    return True
+
+
+def tail_matches(frame, tail, rtol=RECONCILE_RTOL):
+    """
+    True when the closed bars of `frame` that `tail` overlaps still carry the same
+    Close / Adj Close. The last held bar may still have been forming, so it is skipped.
+    """
+    if frame is None or tail is None or len(frame) < 2 or tail.empty:
+        return True
+    if frame.index.tz is not None and tail.index.tz is not None:
+        tail = tail.tz_convert(frame.index.tz)
+    closed = frame.iloc[:-1]
+    common = closed.index.intersection(tail.index)
+    if common.empty:
+        return True
+    for column in ("Close", "Adj Close"):
+        if column in closed.columns and column in tail.columns:
+            held = closed.loc[common, column].to_numpy(dtype=float)
+            fresh = tail.loc[common, column].to_numpy(dtype=float)
+            if not np.allclose(held, fresh, rtol=rtol, equal_nan=True):
+                return False
+    return True
+
+
+def tail_start(frame):
+    """Start of the tail request: the last closed bar, so every refresh overlaps one bar to reconcile."""
+    return frame.index[-2] if len(frame) > 1 else frame.index[-1]
+
+
+def _as_utc(ts):
+    return ts.tz_convert("UTC") if ts.tzinfo is not None else ts.tz_localize("UTC")
+
+
+def resample_ohlcv(df, rule):
+    """Aggregate bars into `rule` buckets: first open, max high, min low, last close, summed volume."""
+    if df is None or df.empty:
+        return pd.DataFrame()
+    agg = {column: how for column, how in OHLCV_AGG.items() if column in df.columns}
+    if rule == "W-MON":
+        resampled = df.resample(rule, label="left", closed="left").agg(agg)
+    elif rule.endswith("min"):
+        resampled = df.resample(rule, origin="start").agg(agg)
+    else:
+        resampled = df.resample(rule).agg(agg)
+    return resampled.dropna(subset=["Close"])
+
+
+def bucket_ohlcv(df, max_bars):
+    """
+    Merge consecutive bars into at most `max_bars` equal-count buckets with the same
+    OHLCV rules as resample_ohlcv, so no high/low or volume is lost when thinning a
+    frame for display. Each bucket is labelled with its first timestamp.
+    """
+    if df is None or df.empty:
+        return pd.DataFrame()
+    df = df.dropna(subset=["Close"])
+    n = len(df)
+    if n <= max_bars:
+        return df
+
+    size = -(-n // max_bars)
+    starts = np.arange(0, n, size)
+    ends = np.append(starts[1:], n) - 1
+    columns = {}
+    for column, how in OHLCV_AGG.items():
+        if column not in df.columns:
+            continue
+        values = df[column].to_numpy(dtype=float)
+        if how == "first":
+            columns[column] = values[starts]
+        elif how == "last":
+            columns[column] = values[ends]
+        elif how == "max":
+            columns[column] = np.fmax.reduceat(values, starts)
+        elif how == "min":
+            columns[column] = np.fmin.reduceat(values, starts)
+        else:
+            columns[column] = np.add.reduceat(np.nan_to_num(values), starts)
+    return pd.DataFrame(columns, index=df.index[starts])
+
+
+def derive_period(canonical, period):
+    """Build the `period` frame from its canonical series without another download."""
+    frame = slice_period(canonical, period)
+    rule = RESAMPLE_RULES.get(period)
+    return resample_ohlcv(frame, rule) if rule else frame
+
+
+def resolve_yahoo_symbol(ticker, registry, overrides):
+    if ticker in overrides:
+        return overrides[ticker]
+    return registry.resolve(ticker) or ticker
+
+
+def alternate_yahoo_symbol(ticker, yahoo_symbol, overrides):
+    """上市/上櫃代號互為備援：.TW 查無資料改試 .TWO，反之亦然。"""
+    if not ticker.endswith(".TW") or ticker in overrides:
+        return None
+    otc_symbol = ticker.replace(".TW", ".TWO")
+    return otc_symbol if yahoo_symbol == ticker else ticker
+
+
+def fetch_with_fallback(tickers, fetch, registry, overrides):
+    """
+    Run `fetch(yahoo_symbols) -> {symbol: frame}` for watchlist tickers.
+    Empty .TW/.TWO results are retried once on the other listing and the
+    symbol that returned data is recorded in the registry.
+    """
+    results = {ticker: pd.DataFrame() for ticker in tickers}
+    download_map = {ticker: resolve_yahoo_symbol(ticker, registry, overrides) for ticker in tickers}
+    frames = fetch(tuple(download_map.values()))
+    for ticker in tickers:
+        results[ticker] = frames.get(download_map[ticker], pd.DataFrame())
+
+    fallback_map = {}
+    for ticker in tickers:
+        if results[ticker].empty:
+            alternate = alternate_yahoo_symbol(ticker, download_map[ticker], overrides)
+            if alternate:
+                fallback_map[ticker] = alternate
+        elif ticker.endswith(".TW"):
+            registry.record(ticker, download_map[ticker])
+
+    if fallback_map:
+        fallback_frames = fetch(tuple(fallback_map.values()))
+        for original, fallback in fallback_map.items():
+            results[original] = fallback_frames.get(fallback, pd.DataFrame())
+            if not results[original].empty:
+                registry.record(original, fallback)
+    return results
+
+
+class _FlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class SingleFlight:
+    """
+    Collapses concurrent fetches across sessions and threads: callers asking
+    for keys that are already in flight wait for that call instead of firing
+    the same Yahoo request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def do_many(self, keys, fetch, timeout=60):
+        """
+        Call `fetch(claimed_keys)` once for the keys nobody else is fetching,
+        then wait for the keys owned by other in-flight calls. `fetch` is
+        expected to publish its results to shared state.
+        """
+        call = _FlightCall()
+        with self._lock:
+            claimed = tuple(key for key in dict.fromkeys(keys) if key not in self._inflight)
+            waiting = {id(self._inflight[key]): self._inflight[key] for key in keys if key in self._inflight}
+            for key in claimed:
+                self._inflight[key] = call
+
+        try:
+            if claimed:
+                fetch(claimed)
+        finally:
+            with self._lock:
+                for key in claimed:
+                    if self._inflight.get(key) is call:
+                        del self._inflight[key]
+            call.done.set()
+
+        for other in waiting.values():
+            other.done.wait(timeout)
+        return claimed
+
+
+class CanonicalFrames:
+    """
+    Process-wide in-memory copy of one canonical series (see CANONICAL_SERIES).
+    After the first load, a refresh only downloads bars from the last closed bar
+    onwards, then appends them or replaces the still-forming last bar in place.
+    When the overlapping closed bar no longer matches (Yahoo re-adjusted the
+    history after a split or dividend) the whole series is downloaded again.
+    """
+
+    def __init__(self, store, kind):
+        config = CANONICAL_SERIES[kind]
+        self.store = store
+        self.kind = kind
+        self.interval = config["interval"]
+        self.yf_period = config["yf_period"]
+        self.keep = config["keep"]
+        self.min_refresh_seconds = config["min_refresh_seconds"]
+        self._frames = {}
+        self._refreshed_at = {}
+        self._reseed = set()
+        self._lagging_checked_at = {}
+        self._period_prices = {}
+        self.version = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def get(self, symbol):
+        with self._lock:
+            return self._frames.get(symbol, pd.DataFrame())
+
+    def loaded(self, symbol):
+        """True once `symbol` has been fetched at least once (even if Yahoo returned nothing)."""
+        with self._lock:
+            return symbol in self._refreshed_at
+
+    def period_prices(self, symbol, period):
+        """(period start close, last close) from the table computed at download time."""
+        with self._lock:
+            prices = self._period_prices.get(symbol, {})
+        return prices.get(period), prices.get("last")
+
+    def invalidate(self, reseed=False):
+        """Make every symbol due; with `reseed`, their next refresh downloads the full series again."""
+        with self._lock:
+            self._refreshed_at.clear()
+            if reseed:
+                self._reseed.update(self._frames)
+
+    def refresh(self, symbols, missing_only=False):
+        """
+        Bring `symbols` up to date and return their frames.
+        With `missing_only`, symbols that were loaded before are served from
+        memory as-is (the background worker keeps them fresh). Symbols another
+        thread is already downloading are waited on instead of fetched twice.
+        """
+        symbols = tuple(dict.fromkeys(symbols))
+        now = time.time()
+        with self._lock:
+            if missing_only:
+                due = [symbol for symbol in symbols if symbol not in self._refreshed_at]
+            else:
+                due = [
+                    symbol for symbol in symbols
+                    if now - self._refreshed_at.get(symbol, 0) >= self.min_refresh_seconds
+                ]
+
+        if due:
+            self._flight.do_many(due, self._download)
+        with self._lock:
+            return {symbol: self._frames.get(symbol, pd.DataFrame()) for symbol in symbols}
+
+    def _download(self, symbols):
+        with self._lock:
+            reseed = self._reseed.intersection(symbols)
+            self._reseed.difference_update(symbols)
+            frames = {
+                symbol: self._frames[symbol]
+                for symbol in symbols
+                if symbol in self._frames and symbol not in reseed
+            }
+
+        for symbol in symbols:
+            if symbol not in frames and symbol not in reseed:
+                seeded = self._seed_from_store(symbol)
+                if not seeded.empty:
+                    frames[symbol] = seeded
+
+        stale = []
+        groups, lagging = self._tail_groups(frames)
+        for group, start in groups.items():
+            if frames[group[0]].index.tz is None:
+                start = start.tz_localize(None).normalize()
+            for symbol, tail in download_history(group, self.interval, start=start).items():
+                if tail.empty:
+                    continue
+                if symbol in lagging or not tail_matches(frames[symbol], tail):
+                    # 落後標的恢復交易時中間缺的 K 棒、或歷史被改寫，都要整條重抓
+                    stale.append(symbol)
+                else:
+                    frames[symbol] = slice_period(merge_tail(frames[symbol], tail), self.keep)
+                    self.store.write(symbol, self.interval, tail)
+
+        # 冷啟動、🔄 強制重抓與歷史被改寫的標的一次抓完整序列，並取代本地已存的 K 棒
+        cold = [symbol for symbol in symbols if symbol not in frames] + stale
+        if cold:
+            for symbol, frame in download_history(cold, self.interval, period=self.yf_period).items():
+                if not frame.empty:
+                    frames[symbol] = slice_period(frame, self.keep)
+                    self.store.write(symbol, self.interval, frame, period=self.yf_period, replace=True)
+
+        prices = {symbol: self._compute_period_prices(frames[symbol]) for symbol in symbols if symbol in frames}
+        refreshed_at = time.time()
+        with self._lock:
+            for symbol in symbols:
+                self._refreshed_at[symbol] = refreshed_at
+            self._frames.update(frames)
+            self._period_prices.update(prices)
+            self.version += 1
+
+    def _tail_groups(self, frames):
+        """
+        ({(symbols...): start (UTC)}, lagging symbols) for the tail requests of one refresh.
+        Symbols are grouped by a coarse tail start, so crypto trading through a weekend
+        or the TW session never drags a market with an older start into its request.
+        Symbols lagging more than TAIL_MAX_AGE share one request from the cap onwards,
+        at most every LAGGING_RECHECK_SECONDS; data returned there means trading resumed.
+        """
+        floor = pd.Timestamp.now(tz="UTC") - TAIL_MAX_AGE[self.interval]
+        now = time.time()
+        buckets, lagging = {}, []
+        for symbol, frame in frames.items():
+            start = _as_utc(tail_start(frame))
+            if start >= floor:
+                buckets.setdefault(start.floor(TAIL_GROUP_FREQ[self.interval]), []).append((symbol, start))
+            elif now - self._lagging_checked_at.get(symbol, 0) >= LAGGING_RECHECK_SECONDS:
+                self._lagging_checked_at[symbol] = now
+                lagging.append(symbol)
+
+        groups = {
+            tuple(symbol for symbol, _ in members): min(start for _, start in members)
+            for members in buckets.values()
+        }
+        if lagging:
+            groups[tuple(lagging)] = floor
+        return groups, set(lagging)
+
+    def _compute_period_prices(self, frame):
+        # 各週期的起始價與最後價只在下載後計算一次，metrics / 排序直接查表
+        if frame is None or frame.empty:
+            return {}
+        close = frame[["Close"]]
+        prices = {"last": latest_close(close)}
+        for period, source in PERIOD_SOURCES.items():
+            if source != self.kind:
+                continue
+            derived = derive_period(close, period)["Close"].dropna()
+            if len(derived):
+                prices[period] = float(derived.iloc[0])
+        return prices
+
+    def _seed_from_store(self, symbol):
+        info = self.store.series_info(symbol, self.interval)
+        if not _store_covers(info, self.interval, self.yf_period):
+            return pd.DataFrame()
+        lookback = READ_LOOKBACK.get(self.keep)
+        start = info["last_ts"] - lookback if lookback is not None else None
+        frame = self.store.read(symbol, self.interval, start=start)
+        return slice_period(normalize_hist_frame(frame), self.keep)
+
+
+class MarketDataWorker:
+    """
+    Daemon thread that keeps the canonical series warm for every watched
+    ticker on the configured refresh interval, so Streamlit reruns only read
+    in-memory frames instead of waiting on Yahoo.
+    """
+
+    def __init__(self, frames, registry, overrides, interval_seconds=60):
+        self.frames = frames
+        self.registry = registry
+        self.overrides = overrides
+        self.interval_seconds = interval_seconds
+        self._tickers = ()
+        self._priority = ()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="market-data-worker", daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def watch(self, tickers, interval_seconds=None):
+        """Replace the watched tickers; newly added ones load on the next `request_load()` or cycle."""
+        with self._lock:
+            self._tickers = tuple(sorted(dict.fromkeys(tickers)))
+            interval_changed = interval_seconds is not None and interval_seconds != self.interval_seconds
+            if interval_changed:
+                self.interval_seconds = interval_seconds
+        if interval_changed:
+            # 讓正在等待舊週期的 worker 立即套用新的刷新間隔
+            self._wake.set()
+
+    def request_load(self, tickers=()):
+        """Wake the worker to load unloaded tickers in the background, fetching `tickers` first."""
+        with self._lock:
+            self._priority = tuple(dict.fromkeys((*self._priority, *tickers)))
+        self._wake.set()
+
+    def request_refresh(self):
+        """🔄：所有標的重新下載完整序列，順便修正本地已存但被 Yahoo 改寫過的歷史。"""
+        for frames in self.frames.values():
+            frames.invalidate(reseed=True)
+        self._wake.set()
+
+    def refresh_once(self):
+        with self._lock:
+            tickers = self._tickers
+            priority, self._priority = self._priority, ()
+        if not tickers and not priority:
+            return
+        try:
+            # 畫面上看得到的標的先抓；第二輪遇到剛更新過的標的會因 min_refresh 直接略過
+            for batch in (priority, tickers):
+                if not batch:
+                    continue
+                for frames in self.frames.values():
+                    fetch_with_fallback(batch, frames.refresh, self.registry, self.overrides)
+        except Exception as exc:
+            print(f"market data worker refresh failed: {type(exc).__name__}: {exc}")
+
+    def _run(self):
+        while True:
+            # interval 0 代表關閉頁面自動刷新；資料仍以 IDLE_REFRESH_SECONDS 的底線週期更新
+            timeout = self.interval_seconds if self.interval_seconds > 0 else IDLE_REFRESH_SECONDS
+            self._wake.wait(timeout=timeout)
+            self._wake.clear()
+            self.refresh_once()
+
+
+def merge_tail(frame, tail):
+    """Append `tail` to `frame`; bars from the first tail timestamp onwards are replaced."""
+    if frame is None or frame.empty:
+        return tail
+    if tail is None or tail.empty:
+        return frame
+    if frame.index.tz is not None and tail.index.tz is not None:
+        tail = tail.tz_convert(frame.index.tz)
+    head = frame[frame.index < tail.index[0]]
+    return pd.concat([head, tail])
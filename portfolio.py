@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+BASE_CURRENCY = "TWD"
+# 依代號後綴推斷計價幣別；其餘（美股、加密貨幣）預設為 USD
+CURRENCY_SUFFIXES = {".TWO": "TWD", ".TW": "TWD", ".T": "JPY", ".HK": "HKD"}
+DEFAULT_CURRENCY = "USD"
+DEFAULT_FX_RATES = {"TWD": 1.0, "USD": 32.0}
+CURRENCY_SYMBOLS = {"TWD": "NT$", "USD": "US$", "JPY": "¥", "HKD": "HK$"}
+
+METRIC_COLUMNS = [
+    "market",
+    "currency",
+    "shares",
+    "avg_cost",
+    "last_price",
+    "start_price",
+    "change",
+    "change_pct",
+    "value",
+    "cost_basis",
+    "pnl",
+    "pnl_pct",
+    "fx_rate",
+    "value_twd",
+    "cost_basis_twd",
+    "pnl_twd",
+]
+
+
+def infer_currency(ticker):
+    ticker = str(ticker or "").strip().upper()
+    for suffix, currency in CURRENCY_SUFFIXES.items():
+        if ticker.endswith(suffix):
+            return currency
+    return DEFAULT_CURRENCY
+
+
+def instrument_currency(item, is_cash=False):
+    """The item's explicit `currency` field wins; otherwise infer it from the ticker suffix."""
+    if is_cash:
+        return BASE_CURRENCY
+    return str(item.get("currency") or "").strip().upper() or infer_currency(item.get("ticker"))
+
+
+def fx_symbol(currency):
+    """Yahoo symbol quoting one unit of `currency` in TWD, e.g. JPYTWD=X."""
+    return None if currency == BASE_CURRENCY else f"{currency}{BASE_CURRENCY}=X"
+
+
+def currency_symbol(currency):
+    return CURRENCY_SYMBOLS.get(currency, f"{currency} ")
+
+
+def _to_float_array(values):
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float)
+
+
+def build_metrics(items, markets, start_prices, last_prices, fx_rates):
+    """
+    Build the per-ticker metrics table for one chart period.
+    `markets`, `start_prices` and `last_prices` are dicts keyed by ticker;
+    missing prices stay NaN so unloaded tickers sort last.
+    `fx_rates` maps a currency to its TWD rate; a currency without a rate
+    leaves the TWD columns NaN rather than guessing.
+    Cash rows carry their balance as both shares and value.
+    """
+    tickers = list(dict.fromkeys(str(item.get("ticker", "")).strip() for item in items))
+    by_ticker = {str(item.get("ticker", "")).strip(): item for item in items}
+    rows = [by_ticker[ticker] for ticker in tickers]
+
+    market = np.array([markets.get(ticker, "us") for ticker in tickers], dtype=object)
+    shares = np.nan_to_num(_to_float_array([item.get("shares") for item in rows]))
+    avg_cost = np.nan_to_num(_to_float_array([item.get("avg_cost") for item in rows]))
+    last = _to_float_array([last_prices.get(ticker) for ticker in tickers])
+    start = _to_float_array([start_prices.get(ticker) for ticker in tickers])
+
+    is_cash = market == "cash"
+    currency = np.array(
+        [instrument_currency(item, is_cash=flag) for item, flag in zip(rows, is_cash)],
+        dtype=object,
+    )
+    held = shares > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = last - start
+        change_pct = np.where(start > 0, change / start * 100, np.nan)
+        value = np.where(held, last * shares, np.nan)
+        cost_basis = np.where(held & (avg_cost > 0) & ~is_cash, avg_cost * shares, np.nan)
+        pnl = value - cost_basis
+        pnl_pct = pnl / cost_basis * 100
+
+    fx_rate = pd.Series(currency, dtype=object).map(fx_rates).astype(float).to_numpy()
+    metrics = pd.DataFrame(
+        {
+            "market": market,
+            "currency": currency,
+            "shares": shares,
+            "avg_cost": avg_cost,
+            "last_price": last,
+            "start_price": start,
+            "change": change,
+            "change_pct": change_pct,
+            "value": value,
+            "cost_basis": cost_basis,
+            "pnl": pnl,
+            "pnl_pct": pnl_pct,
+            "fx_rate": fx_rate,
+            "value_twd": value * fx_rate,
+            "cost_basis_twd": cost_basis * fx_rate,
+            "pnl_twd": pnl * fx_rate,
+        },
+        index=pd.Index(tickers, name="ticker"),
+    )
+    return metrics[METRIC_COLUMNS]
+
+
+def metric_value(metrics, ticker, column):
+    """Return a single metric as a float, or None when the ticker is unknown or the value is NaN."""
+    if ticker not in metrics.index:
+        return None
+    value = metrics.at[ticker, column]
+    return None if pd.isna(value) else float(value)
+
+
+def sort_items(items, metrics, column, ascending):
+    """Stable sort of watchlist items by a metrics column; NaN keys always go last."""
+    keys = metrics[column].reindex([item["ticker"] for item in items]).reset_index(drop=True)
+    order = keys.sort_values(ascending=ascending, na_position="last", kind="stable").index
+    return [items[i] for i in order]
+
+
+def summarize(metrics):
+    """Portfolio totals in TWD; positions without a price are left out, as before."""
+    priced = metrics[metrics["value_twd"].notna()]
+    is_cash = priced["market"] == "cash"
+    with_cost = priced["cost_basis_twd"].notna()
+    total_cost = float(priced.loc[with_cost, "cost_basis_twd"].sum())
+    total_profit = float(priced.loc[with_cost, "pnl_twd"].sum())
+    return {
+        "total_value": float(priced["value_twd"].sum()),
+        "cash_value": float(priced.loc[is_cash, "value_twd"].sum()),
+        "total_cost": total_cost,
+        "total_profit": total_profit,
+        "total_pct": total_profit / total_cost * 100 if total_cost > 0 else 0.0,
+    }
+
+
+def market_breakdown(metrics):
+    """Per-market totals in TWD (value, cost basis, P&L, weight), largest first."""
+    priced = metrics[metrics["value_twd"].notna()]
+    if priced.empty:
+        return pd.DataFrame(columns=["value_twd", "cost_basis_twd", "pnl_twd", "weight"])
+    grouped = priced.groupby("market")[["value_twd", "cost_basis_twd", "pnl_twd"]].sum(min_count=1)
+    total = grouped["value_twd"].sum()
+    grouped["weight"] = grouped["value_twd"] / total * 100 if total > 0 else 0.0
+    return grouped.sort_values("value_twd", ascending=False)
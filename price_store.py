@@ -0,0 +1,251 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+PRICE_STORE_DB = os.path.join("local_backups", "price_store.sqlite")
+BAR_COLUMNS = {
+    "Open": "open",
+    "High": "high",
+    "Low": "low",
+    "Close": "close",
+    "Adj Close": "adj_close",
+    "Volume": "volume",
+}
+SYMBOL_REVALIDATE_SECONDS = 7 * 24 * 3600
+_SCHEMA_READY = set()
+
+
+def _connect(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    if path not in _SCHEMA_READY:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bars (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                adj_close REAL,
+                volume REAL,
+                PRIMARY KEY (symbol, interval, ts)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS series (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                tz TEXT DEFAULT '',
+                period TEXT DEFAULT '',
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (symbol, interval)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS symbol_resolution (
+                ticker TEXT PRIMARY KEY,
+                yahoo_symbol TEXT NOT NULL,
+                verified_at REAL NOT NULL
+            )
+            """
+        )
+        conn.commit()
+        _SCHEMA_READY.add(path)
+    return conn
+
+
+class PriceStore:
+    """
+    Local OHLCV bar store keyed by (symbol, interval).
+    Every bar ever downloaded is kept, so callers only need to ask yfinance
+    for bars newer than `series_info()["last_ts"]`.
+    """
+
+    def __init__(self, path=PRICE_STORE_DB):
+        self.path = path
+
+    def _connect(self):
+        return _connect(self.path)
+
+    def series_info(self, symbol, interval):
+        """Return {"tz", "period", "last_ts"} for a stored series, or None."""
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT tz, period FROM series WHERE symbol = ? AND interval = ?",
+                    (symbol, interval),
+                ).fetchone()
+                if not row:
+                    return None
+                last = conn.execute(
+                    "SELECT MAX(ts) FROM bars WHERE symbol = ? AND interval = ?",
+                    (symbol, interval),
+                ).fetchone()
+        except Exception as exc:
+            print(f"price store lookup failed: {type(exc).__name__}: {exc}")
+            return None
+
+        if not last or last[0] is None:
+            return None
+        return {
+            "tz": row[0] or "",
+            "period": row[1] or "",
+            "last_ts": _from_epoch([last[0]], row[0]).max(),
+        }
+
+    def read(self, symbol, interval, start=None):
+        try:
+            with self._connect() as conn:
+                meta = conn.execute(
+                    "SELECT tz FROM series WHERE symbol = ? AND interval = ?",
+                    (symbol, interval),
+                ).fetchone()
+                sql = (
+                    "SELECT ts, open, high, low, close, adj_close, volume "
+                    "FROM bars WHERE symbol = ? AND interval = ?"
+                )
+                params = [symbol, interval]
+                if start is not None:
+                    sql += " AND ts >= ?"
+                    params.append(int(_to_epoch(pd.DatetimeIndex([start]))[0]))
+                rows = conn.execute(sql + " ORDER BY ts", params).fetchall()
+        except Exception as exc:
+            print(f"price store read failed: {type(exc).__name__}: {exc}")
+            return pd.DataFrame()
+
+        if not rows:
+            return pd.DataFrame()
+
+        frame = pd.DataFrame(rows, columns=["ts", *BAR_COLUMNS.values()])
+        frame.index = _from_epoch(frame.pop("ts"), meta[0] if meta else "")
+        frame.index.name = "Datetime"
+        frame.columns = list(BAR_COLUMNS)
+        return frame.astype(float)
+
+    def write(self, symbol, interval, df, period="", replace=False):
+        """
+        Upsert bars; a bar with an existing timestamp replaces the stored one.
+        With `replace`, every stored bar of the series is dropped first (full re-download).
+        """
+        if df is None or df.empty or not isinstance(df.index, pd.DatetimeIndex):
+            return 0
+
+        tz = str(df.index.tz) if df.index.tz is not None else ""
+        epochs = _to_epoch(df.index)
+        columns = [
+            df[column].astype(float).tolist() if column in df.columns else [None] * len(df)
+            for column in BAR_COLUMNS
+        ]
+        rows = [
+            (symbol, interval, int(ts), *values)
+            for ts, *values in zip(epochs, *columns)
+        ]
+
+        try:
+            with self._connect() as conn:
+                if replace:
+                    conn.execute("DELETE FROM bars WHERE symbol = ? AND interval = ?", (symbol, interval))
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO bars (
+                        symbol, interval, ts, open, high, low, close, adj_close, volume
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    rows,
+                )
+                existing = conn.execute(
+                    "SELECT period FROM series WHERE symbol = ? AND interval = ?",
+                    (symbol, interval),
+                ).fetchone()
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO series (symbol, interval, tz, period, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (
+                        symbol,
+                        interval,
+                        tz,
+                        period or (existing[0] if existing else ""),
+                        datetime.now(timezone.utc).isoformat(),
+                    ),
+                )
+            return len(rows)
+        except Exception as exc:
+            print(f"price store write failed: {type(exc).__name__}: {exc}")
+            return 0
+
+
+class SymbolRegistry:
+    """
+    Remembers which Yahoo symbol actually returned data for a watchlist ticker
+    (e.g. 3184.TW -> 3184.TWO), so OTC stocks stop paying for a failed .TW request.
+    Entries older than `revalidate_seconds` are ignored until a fetch confirms them again.
+    """
+
+    def __init__(self, path=PRICE_STORE_DB, revalidate_seconds=SYMBOL_REVALIDATE_SECONDS):
+        self.path = path
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        entries = {}
+        try:
+            with _connect(self.path) as conn:
+                rows = conn.execute("SELECT ticker, yahoo_symbol, verified_at FROM symbol_resolution").fetchall()
+            entries = {ticker: (symbol, verified_at) for ticker, symbol, verified_at in rows}
+        except Exception as exc:
+            print(f"symbol registry load failed: {type(exc).__name__}: {exc}")
+        self._entries = entries
+        return entries
+
+    def resolve(self, ticker):
+        """Return the verified Yahoo symbol for `ticker`, or None when unknown or due for re-validation."""
+        with self._lock:
+            entry = self._load().get(ticker)
+        if not entry or time.time() - entry[1] > self.revalidate_seconds:
+            return None
+        return entry[0]
+
+    def record(self, ticker, yahoo_symbol):
+        now = time.time()
+        with self._lock:
+            entries = self._load()
+            current = entries.get(ticker)
+            if current and current[0] == yahoo_symbol and now - current[1] <= self.revalidate_seconds:
+                return
+            entries[ticker] = (yahoo_symbol, now)
+        try:
+            with _connect(self.path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO symbol_resolution (ticker, yahoo_symbol, verified_at) VALUES (?, ?, ?)",
+                    (ticker, yahoo_symbol, now),
+                )
+        except Exception as exc:
+            print(f"symbol registry write failed: {type(exc).__name__}: {exc}")
+
+
+def _to_epoch(index):
+    index = pd.DatetimeIndex(index)
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    return index.tz_convert("UTC").as_unit("s").asi8
+
+
+def _from_epoch(values, tz):
+    index = pd.DatetimeIndex(pd.to_datetime(list(values), unit="s", utc=True))
+    return index.tz_convert(tz) if tz else index.tz_localize(None)
@@ -1,32 +1,63 @@
+import numpy as np
+
+
+def downsample_minmax(values, buckets):
+    """
+    Shape-preserving downsampling: keep the min and the max of each bucket (plus the
+    first and last point), in their original order. Returns the kept indices.
+    Series that already fit in `buckets * 2` points are returned untouched.
+    """
+    n = len(values)
+    if n <= buckets * 2:
+        return np.arange(n)
+
+    size = -(-n // buckets)
+    rows = -(-n // size)
+    padded = np.full(rows * size, np.nan)
+    padded[:n] = values
+    grid = padded.reshape(rows, size)
+    offsets = np.arange(rows) * size
+    keep = np.concatenate(([0, n - 1], offsets + np.nanargmin(grid, axis=1), offsets + np.nanargmax(grid, axis=1)))
+    return np.unique(keep)
+
+
+def _path_points(x, y):
+    # 一次把所有座標格式化成 "x,y"，不逐點組字串
+    return " ".join(np.char.add(np.char.add(np.char.mod("%.1f", x), ","), np.char.mod("%.1f", y)))
+
+
 def create_sparkline(data, color='blue', width=200, height=50):
     """
     Generates a sparkline as an inline SVG string (no matplotlib overhead).
+    `data` may be a list, NumPy array or pandas Series; NaNs are dropped and long
+    series are downsampled to about one point per horizontal pixel.
     Returns: SVG markup string for use with st.markdown(unsafe_allow_html=True).
     """
-    if not data or len(data) < 2:
+    if data is None:
+        return None
+    values = np.asarray(data, dtype=float)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n < 2:
         return None
 
-    n = len(data)
-    min_val = min(data)
-    max_val = max(data)
+    index = downsample_minmax(values, max(width // 2, 1))
+    kept = values[index]
+    min_val = kept.min()
+    max_val = kept.max()
     val_range = max_val - min_val if max_val != min_val else 1
 
-    # Build SVG polyline points
-    points = []
-    for i, v in enumerate(data):
-        x = (i / (n - 1)) * width
-        y = height - ((v - min_val) / val_range) * height
-        points.append(f"{x:.1f},{y:.1f}")
-    points_str = " ".join(points)
-
-    # Build fill polygon (close path along bottom)
-    fill_points = points_str + f" {width:.1f},{height} 0,{height}"
+    x = index / (n - 1) * width
+    y = height - (kept - min_val) / val_range * height
+    line = "M" + _path_points(x, y)
+    # Fill path closes the line along the bottom edge
+    fill = f"{line} L{width},{height} L0,{height}Z"
 
     svg = (
         f'<svg width="100%" viewBox="0 0 {width} {height}" preserveAspectRatio="none" '
         f'xmlns="http://www.w3.org/2000/svg" style="display:block;">'
-        f'<polyline points="{fill_points}" fill="{color}" fill-opacity="0.1" stroke="none"/>'
-        f'<polyline points="{points_str}" fill="none" stroke="{color}" stroke-width="2" '
+        f'<path d="{fill}" fill="{color}" fill-opacity="0.1" stroke="none"/>'
+        f'<path d="{line}" fill="none" stroke="{color}" stroke-width="2" '
         f'vector-effect="non-scaling-stroke"/>'
         f'</svg>'
     )
@@ -1,22 +1,47 @@
+import hashlib
 import json
 import os
 import sqlite3
+import threading
 import time
-import urllib.request
+from collections import deque
 from datetime import datetime, timezone
 
+import requests
 import streamlit as st
 
+from price_store import SymbolRegistry
+
 MAP_FILE = "tw_stock_map.json"
 WATCHLIST_FILE = "watchlist.json"
 LOCAL_BACKUP_DB = os.path.join("local_backups", "investmenttool_backup.sqlite")
 CASH_TICKER = "CASH_TWD"
 CASH_DISPLAY_NAME = "持有現金"
 SHEETS_RETRIES = 1
-SHEETS_TIMEOUT_SECONDS = 8
+# 每個 action 的總時間預算（含重試）；超過就放棄，交給本機備份或 write queue 重試
+SHEETS_LATENCY_BUDGETS = {
+    "bootstrap": 8,
+    "load_watchlist": 6,
+    "load_settings": 4,
+    "save_settings": 8,
+    "upsert_targets": 10,
+    "delete_targets": 10,
+    "reorder_targets": 10,
+    "save_watchlist": 15,
+}
+SHEETS_DEFAULT_BUDGET_SECONDS = 8
 SHEETS_BACKOFF_SECONDS = 120
+SHEETS_BREAKER_WINDOW_SECONDS = 300
+SHEETS_BREAKER_MIN_CALLS = 2
+SHEETS_BREAKER_FAILURE_RATIO = 0.5
+SHEETS_POOL_SIZE = 4
 SHEETS_STATUS_KEY = "_sheets_connection_warning"
-_SHEETS_BACKOFF_UNTIL = 0
+WATCHLIST_MAX_AGE_SECONDS = 30
+WRITE_QUEUE_DEBOUNCE_SECONDS = 1.5
+WRITE_QUEUE_RETRY_SECONDS = (5, 15, 60, 300)
+ORDER_JOURNAL_KEY = "__order__"
+# 上一次寫進本機備份的內容 hash；相同就跳過整個寫入
+_local_watchlist_hash = None
 
 
 @st.cache_resource
@@ -38,9 +63,114 @@ def get_sheets_config():
     return {"web_app_url": web_app_url, "token": token}
 
 
+@st.cache_resource
+def get_sheets_session():
+    """
+    Keep-alive HTTP session shared by every Sheets action and thread. Apps Script answers
+    each POST with a redirect to script.googleusercontent.com; the session keeps a pooled
+    TLS connection to both hosts, so only the first call pays the handshakes.
+    Responses are requested gzip-compressed; request bodies stay plain JSON because
+    Apps Script cannot decode a gzip-encoded POST body.
+    """
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=SHEETS_POOL_SIZE))
+    session.headers.update({"Content-Type": "application/json; charset=utf-8", "Accept-Encoding": "gzip"})
+    return session
+
+
+class SheetsUnavailableError(RuntimeError):
+    """Raised without touching the network while the Sheets circuit breaker is open."""
+
+
+class SheetsCircuitBreaker:
+    """
+    Circuit breaker shared by every Sheets action (reads and writes) across sessions.
+    Closed: calls go through and each attempt is recorded in a rolling window.
+    Open: once at least `min_calls` attempts in the window failed at `failure_ratio`
+    or more, calls fail immediately for `cooldown_seconds`.
+    Half-open: after the cooldown a single probe call is let through; success closes
+    the circuit, failure re-opens it.
+    """
+
+    def __init__(
+        self,
+        window_seconds=SHEETS_BREAKER_WINDOW_SECONDS,
+        min_calls=SHEETS_BREAKER_MIN_CALLS,
+        failure_ratio=SHEETS_BREAKER_FAILURE_RATIO,
+        cooldown_seconds=SHEETS_BACKOFF_SECONDS,
+    ):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown_seconds = cooldown_seconds
+        self.state = "closed"
+        self.opened_at = 0
+        self._calls = deque()
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self, action):
+        with self._lock:
+            if self.state == "open":
+                retry_in = self.opened_at + self.cooldown_seconds - time.time()
+                if retry_in > 0:
+                    raise SheetsUnavailableError(
+                        f"Google Sheets circuit is open; skipping '{action}' for another {retry_in:.0f}s."
+                    )
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    raise SheetsUnavailableError(f"Google Sheets circuit is half-open; skipping '{action}'.")
+                self._probing = True
+
+    def record(self, ok, latency):
+        with self._lock:
+            now = time.time()
+            self._calls.append((now, ok, latency))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+
+            probing, self._probing = self._probing, False
+            if ok:
+                if probing:
+                    self.state = "closed"
+                    self._calls.clear()
+                return
+            if probing or self.state == "open" or self._failure_ratio() >= self.failure_ratio:
+                self.state = "open"
+                self.opened_at = now
+
+    def _failure_ratio(self):
+        if len(self._calls) < self.min_calls:
+            return 0.0
+        return sum(1 for _, ok, _ in self._calls if not ok) / len(self._calls)
+
+    def stats(self):
+        """Rolling-window snapshot: state, attempts, failed attempts and mean latency in seconds."""
+        with self._lock:
+            latencies = [latency for _, _, latency in self._calls]
+            return {
+                "state": self.state,
+                "calls": len(self._calls),
+                "failures": sum(1 for _, ok, _ in self._calls if not ok),
+                "mean_latency": sum(latencies) / len(latencies) if latencies else None,
+            }
+
+
+@st.cache_resource
+def get_sheets_breaker():
+    return SheetsCircuitBreaker()
+
+
+@st.cache_resource
+def get_symbol_registry():
+    return SymbolRegistry()
+
+
 def reset_sheets_client():
     try:
         get_sheets_config.clear()
+        get_sheets_session.clear()
     except Exception:
         pass
 
@@ -71,50 +201,63 @@ def get_connection_warning():
         return None
 
 
-def _execute_sheets(action, payload=None):
-    global _SHEETS_BACKOFF_UNTIL
+def _set_unavailable_warning(breaker):
+    # 附上熔斷器滾動視窗的統計，讓使用者知道是偶發失敗還是持續連不上
+    stats = breaker.stats()
+    detail = ""
+    if stats["calls"]:
+        detail = f" ({stats['failures']}/{stats['calls']} recent calls failed, {stats['mean_latency']:.1f}s average)"
+    _set_connection_warning(
+        f"Google Sheets storage is temporarily unavailable{detail}. Showing the latest local backup when possible."
+    )
 
-    is_read_action = action in {"load_watchlist", "load_settings"}
-    now = time.time()
-    if is_read_action and now < _SHEETS_BACKOFF_UNTIL:
-        raise RuntimeError("Google Sheets storage is in temporary backoff; using local backup.")
 
+def _execute_sheets(action, payload=None):
     config = get_sheets_config()
     body = {"action": action, "token": config["token"]}
     if payload:
         body.update(payload)
 
     data = json.dumps(body, ensure_ascii=False).encode("utf-8")
-    last_error = None
+    breaker = get_sheets_breaker()
+    try:
+        breaker.before_call(action)
+    except SheetsUnavailableError:
+        _set_unavailable_warning(breaker)
+        raise
 
+    deadline = time.monotonic() + SHEETS_LATENCY_BUDGETS.get(action, SHEETS_DEFAULT_BUDGET_SECONDS)
+    last_error = None
     for attempt in range(SHEETS_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        started = time.monotonic()
         try:
-            request = urllib.request.Request(
-                config["web_app_url"],
-                data=data,
-                headers={"Content-Type": "application/json; charset=utf-8"},
-                method="POST",
-            )
-            with urllib.request.urlopen(request, timeout=SHEETS_TIMEOUT_SECONDS) as response:
-                raw = response.read().decode("utf-8")
+            response = get_sheets_session().post(config["web_app_url"], data=data, timeout=remaining)
+            response.raise_for_status()
+            raw = response.content.decode("utf-8")
             result = json.loads(raw)
-            if not result.get("ok"):
-                raise RuntimeError(result.get("error") or raw)
-            clear_connection_warning()
-            _SHEETS_BACKOFF_UNTIL = 0
-            return result
         except Exception as exc:
             last_error = exc
+            breaker.record(False, time.monotonic() - started)
             reset_sheets_client()
+            if breaker.state != "closed":
+                break
             if attempt < SHEETS_RETRIES:
-                time.sleep(0.5 * (attempt + 1))
+                time.sleep(min(0.5 * (attempt + 1), max(deadline - time.monotonic(), 0)))
+            continue
+
+        breaker.record(True, time.monotonic() - started)
+        if not result.get("ok"):
+            # Apps Script 有回應但 action 失敗（例如 Unknown action）：重試沒有用，也不算連線故障
+            raise RuntimeError(result.get("error") or raw)
+        clear_connection_warning()
+        return result
 
+    last_error = last_error or SheetsUnavailableError(f"Google Sheets action '{action}' ran out of its latency budget.")
     print(f"Google Sheets action '{action}' failed after retry: {type(last_error).__name__}: {last_error}")
-    if is_read_action:
-        _SHEETS_BACKOFF_UNTIL = time.time() + SHEETS_BACKOFF_SECONDS
-    _set_connection_warning(
-        "Google Sheets storage is temporarily unavailable. Showing the latest local backup when possible."
-    )
+    _set_unavailable_warning(breaker)
     raise last_error
 
 
@@ -192,6 +335,8 @@ def _normalize_item(item):
         "tags": _normalize_tags(item.get("tags")),
         "display_order": _coerce_int(item.get("display_order")),
         "created_at": item.get("created_at") or "",
+        # 空字串代表依代號後綴推斷幣別（見 portfolio.infer_currency）
+        "currency": "" if is_cash_ticker(ticker) else str(item.get("currency") or "").strip().upper(),
     }
 
 
@@ -209,6 +354,7 @@ def _default_cash_item(display_order=0):
         "tags": [],
         "display_order": display_order,
         "created_at": "",
+        "currency": "",
     }
 
 
@@ -279,17 +425,24 @@ def _load_sqlite_watchlist():
 
 
 def _save_local_watchlist(data):
+    """
+    Mirror the watchlist to the local SQLite backup and `watchlist.json`.
+    Nothing is written when the content hash matches the last snapshot; otherwise only
+    rows whose content changed are upserted (one executemany in a WAL transaction)
+    and tickers that disappeared are deleted.
+    """
+    global _local_watchlist_hash
     try:
+        normalized = _normalize_for_save(data)
+        raw_rows = {item["ticker"]: json.dumps(item, ensure_ascii=False, sort_keys=True) for item in normalized}
+        content_hash = hashlib.sha1("\n".join(raw_rows.values()).encode("utf-8")).hexdigest()
+        if content_hash == _local_watchlist_hash:
+            return True
+
         os.makedirs(os.path.dirname(LOCAL_BACKUP_DB), exist_ok=True)
         backed_up_at = datetime.now(timezone.utc).isoformat()
-        normalized = []
-        for i, item in enumerate(_ensure_cash_item(data)):
-            clean_item = _normalize_item(item)
-            clean_item["display_order"] = i
-            if clean_item["ticker"]:
-                normalized.append(clean_item)
-
         with sqlite3.connect(LOCAL_BACKUP_DB) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS watchlist (
@@ -311,37 +464,45 @@ def _save_local_watchlist(data):
                 )
                 """
             )
-            conn.execute("DELETE FROM watchlist")
-            for i, item in enumerate(normalized, start=1):
-                conn.execute(
-                    """
-                    INSERT OR REPLACE INTO watchlist (
-                        id, ticker, custom_name, note, rating, holding, yahoo_url,
-                        tradingview_url, avg_cost, shares, tags, display_order,
-                        created_at, raw_json, backed_up_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        i,
-                        item["ticker"],
-                        item.get("custom_name", ""),
-                        item.get("note", ""),
-                        item.get("rating", 0),
-                        1 if item.get("holding") else 0,
-                        item.get("yahoo_url", ""),
-                        item.get("tradingview_url", ""),
-                        item.get("avg_cost", 0.0),
-                        item.get("shares", 0.0),
-                        json.dumps(item.get("tags", []), ensure_ascii=False),
-                        item.get("display_order", i - 1),
-                        item.get("created_at", ""),
-                        json.dumps(item, ensure_ascii=False),
-                        backed_up_at,
-                    ),
+            existing = dict(conn.execute("SELECT ticker, raw_json FROM watchlist"))
+            removed = [(ticker,) for ticker in existing if ticker not in raw_rows]
+            changed = [
+                (
+                    i,
+                    item["ticker"],
+                    item.get("custom_name", ""),
+                    item.get("note", ""),
+                    item.get("rating", 0),
+                    1 if item.get("holding") else 0,
+                    item.get("yahoo_url", ""),
+                    item.get("tradingview_url", ""),
+                    item.get("avg_cost", 0.0),
+                    item.get("shares", 0.0),
+                    json.dumps(item.get("tags", []), ensure_ascii=False),
+                    item.get("display_order", i - 1),
+                    item.get("created_at", ""),
+                    raw_rows[item["ticker"]],
+                    backed_up_at,
                 )
+                for i, item in enumerate(normalized, start=1)
+                if existing.get(item["ticker"]) != raw_rows[item["ticker"]]
+            ]
+            conn.executemany("DELETE FROM watchlist WHERE ticker = ?", removed)
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO watchlist (
+                    id, ticker, custom_name, note, rating, holding, yahoo_url,
+                    tradingview_url, avg_cost, shares, tags, display_order,
+                    created_at, raw_json, backed_up_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                changed,
+            )
 
-        with open(WATCHLIST_FILE, "w", encoding="utf-8") as f:
-            json.dump(normalized, f, ensure_ascii=False, indent=2)
+        if changed or removed or not os.path.exists(WATCHLIST_FILE):
+            with open(WATCHLIST_FILE, "w", encoding="utf-8") as f:
+                json.dump(normalized, f, ensure_ascii=False, indent=2)
+        _local_watchlist_hash = content_hash
         return True
     except Exception as exc:
         print(f"local watchlist save failed: {type(exc).__name__}: {exc}")
@@ -394,80 +555,459 @@ def get_default_item(ticker):
     }
 
 
-def load_watchlist():
-    local_data = _load_local_watchlist()
-    remote_data = load_watchlist_from_remote()
-    return remote_data or _ensure_cash_item(local_data)
+def _copy_items(items):
+    return [dict(item, tags=list(item.get("tags", []))) for item in items]
 
 
-def load_watchlist_from_remote():
-    local_data = _load_local_watchlist()
+class WatchlistRepository:
+    """
+    Process-wide watchlist state: one normalized in-memory copy plus version metadata.
+    Reruns are served from memory, and the local backup is read at most once per change.
+    Stale-while-revalidate: once the copy is older than `max_age_seconds` (or on a cold
+    start with a local snapshot) the current data is returned immediately while a
+    background thread re-reads Google Sheets and swaps the result in when it differs.
+    Only a forced refresh, or a cold start without any local snapshot, waits on Sheets.
+    `remote_version` is the targets-sheet version the copy was read at; row-level writes
+    send it as `base_version` so Apps Script can report concurrent edits from other clients.
+    `settings` holds the settings that arrived with the last bootstrap payload.
+    """
+
+    def __init__(self, max_age_seconds=WATCHLIST_MAX_AGE_SECONDS):
+        self.max_age_seconds = max_age_seconds
+        self.version = 0
+        self.remote_version = None
+        self.settings = None
+        self.loaded_at = 0
+        self._items = None
+        self._local_items = None
+        self._revalidating = False
+        self._lock = threading.RLock()
+
+    @property
+    def revalidating(self):
+        return self._revalidating
+
+    def get(self, force_remote=False):
+        return self.snapshot(force_remote)[0]
+
+    def snapshot(self, force_remote=False):
+        """Return (items, version) atomically, so callers can tell when a background refresh swapped data in."""
+        with self._lock:
+            if force_remote or (self._items is None and not self.local()):
+                self._load()
+            elif self._items is None:
+                self._set(_ensure_cash_item(self.local()))
+                self._revalidate_in_background()
+            elif time.time() - self.loaded_at >= self.max_age_seconds:
+                self._revalidate_in_background()
+            return _copy_items(self._items), self.version
+
+    def local(self):
+        with self._lock:
+            if self._local_items is None:
+                self._local_items = _load_local_watchlist()
+            return self._local_items
+
+    def commit(self, items):
+        """Record items that were just written (or queued for writing), and mirror them to the local backup."""
+        with self._lock:
+            self._store_local(items)
+            self._set(items)
+
+    def invalidate(self):
+        with self._lock:
+            self._items = None
+
+    def record_remote_write(self, remote_version, stale=False):
+        """
+        Track the sheet version after one of our writes. When another client wrote in
+        between (stale), keep the old version and revalidate on the next read so their
+        rows get merged in instead of being overwritten by our copy.
+        """
+        with self._lock:
+            if stale:
+                self.loaded_at = 0
+            elif remote_version is not None:
+                self.remote_version = remote_version
+
+    def _set(self, items):
+        if items != self._items:
+            self.version += 1
+        self._items = _copy_items(items)
+        self.loaded_at = time.time()
+
+    def _load(self):
+        local_data = self.local()
+        try:
+            normalized, self.remote_version, self.settings = _fetch_remote_watchlist()
+            if normalized:
+                self._store_local(normalized)
+            elif not local_data:
+                _set_connection_warning(
+                    "Google Sheets returned 0 watchlist items. Check that the deployed Streamlit secrets point to the sheet tab named targets."
+                )
+            self._set(normalized)
+        except Exception as exc:
+            if not local_data:
+                _set_connection_warning(f"Could not load Google Sheets watchlist: {type(exc).__name__}: {exc}")
+            self._set(_ensure_cash_item(local_data))
+
+    def _store_local(self, items):
+        if items != self._local_items:
+            _save_local_watchlist(items)
+            self._local_items = _copy_items(items)
+
+    def _revalidate_in_background(self):
+        if self._revalidating:
+            return
+        self._revalidating = True
+        threading.Thread(target=self._revalidate, args=(self.version,), name="watchlist-revalidate", daemon=True).start()
+
+    def _revalidate(self, started_version):
+        try:
+            normalized, remote_version, settings = _fetch_remote_watchlist()
+        except Exception as exc:
+            normalized = None
+            print(f"watchlist background refresh failed: {type(exc).__name__}: {exc}")
+
+        with self._lock:
+            self._revalidating = False
+            # 背景請求期間若有寫入（version 改變），遠端回應可能比記憶體舊，直接丟棄
+            if self.version != started_version:
+                return
+            if normalized:
+                self._store_local(normalized)
+                self._set(normalized)
+                self.remote_version = remote_version
+                self.settings = settings or self.settings
+            else:
+                # 失敗時沿用舊資料，等下一個 max_age 週期再試
+                self.loaded_at = time.time()
+
+
+def _fetch_remote_watchlist():
+    """
+    Return (items, sheet version, settings) from one `bootstrap` call. Against an older
+    Apps Script deployment this falls back to `load_watchlist`, and version/settings are None.
+    """
     try:
+        response = _execute_sheets("bootstrap")
+    except RuntimeError as exc:
+        if "Unknown action" not in str(exc):
+            raise
         response = _execute_sheets("load_watchlist")
-        items = response.get("items")
-        if items is None:
-            items = response.get("watchlist") or response.get("data") or []
-        if not isinstance(items, list):
-            raise RuntimeError(f"Google Sheets returned invalid watchlist payload: {type(items).__name__}")
-        normalized = _ensure_cash_item([
-            _normalize_item(item)
-            for item in items
-            if isinstance(item, dict) and item.get("ticker")
-        ])
-        if normalized:
-            _save_local_watchlist(normalized)
-        elif not local_data:
-            _set_connection_warning(
-                "Google Sheets returned 0 watchlist items. Check that the deployed Streamlit secrets point to the sheet tab named targets."
+    items = response.get("items")
+    if items is None:
+        items = response.get("watchlist") or response.get("data") or []
+    if not isinstance(items, list):
+        raise RuntimeError(f"Google Sheets returned invalid watchlist payload: {type(items).__name__}")
+    normalized = _ensure_cash_item([
+        _normalize_item(item)
+        for item in items
+        if isinstance(item, dict) and item.get("ticker")
+    ])
+    # 還沒送出的本機編輯要疊在遠端快照上，避免被舊資料蓋回去
+    settings = response.get("settings")
+    return (
+        get_write_queue().overlay(normalized),
+        response.get("version"),
+        _normalize_settings(settings) if isinstance(settings, dict) else None,
+    )
+
+
+class WatchlistWriteQueue:
+    """
+    Write-behind queue for watchlist edits. Edits are applied to memory and the local
+    backup right away; this class journals them in SQLite (one row per ticker, so
+    consecutive edits to the same ticker coalesce into one write) and a background
+    thread flushes them to Google Sheets. Failed flushes stay in the journal and are
+    retried with backoff, including after a restart. The journal's keys are mirrored
+    in memory (`_queued`), so the pending count shown on every rerun never touches disk.
+    """
+
+    def __init__(self, path=LOCAL_BACKUP_DB, debounce_seconds=WRITE_QUEUE_DEBOUNCE_SECONDS):
+        self.path = path
+        self.debounce_seconds = debounce_seconds
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="watchlist-write-behind", daemon=True)
+        self._queued = self._init_journal()
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        if self._queued:
+            self._wake.set()
+        return self
+
+    def _init_journal(self):
+        """Create the journal table once and return {key: queued_at} for edits left from a previous run."""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS pending_writes (
+                        key TEXT PRIMARY KEY,
+                        action TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        queued_at REAL NOT NULL,
+                        attempts INTEGER DEFAULT 0,
+                        last_error TEXT DEFAULT ''
+                    )
+                    """
+                )
+                return dict(conn.execute("SELECT key, queued_at FROM pending_writes").fetchall())
+        except Exception as exc:
+            print(f"write queue init failed: {type(exc).__name__}: {exc}")
+            return {}
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        return sqlite3.connect(self.path, timeout=10)
+
+    def enqueue(self, key, action, payload):
+        """Journal an `upsert`, `delete` or `reorder`; a newer entry for the same key replaces the older one."""
+        queued_at = time.time()
+        with self._lock, self._connect() as conn:
+            if action == "upsert":
+                payload = self._coalesce_fields(conn, key, payload)
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO pending_writes (key, action, payload, queued_at, attempts, last_error)
+                VALUES (?, ?, ?, ?, 0, '')
+                """,
+                (key, action, json.dumps(payload, ensure_ascii=False), queued_at),
             )
-        return normalized
-    except Exception as exc:
-        if not local_data:
-            _set_connection_warning(f"Could not load Google Sheets watchlist: {type(exc).__name__}: {exc}")
-        return local_data
+            self._queued[key] = queued_at
+        self._wake.set()
+
+    @staticmethod
+    def _coalesce_fields(conn, key, payload):
+        # 合併同一 ticker 的連續編輯時，_fields 要取聯集；任一筆是整列寫入（_fields 為 None）就維持整列
+        row = conn.execute("SELECT action, payload FROM pending_writes WHERE key = ?", (key,)).fetchone()
+        if not row or row[0] != "upsert" or payload.get("_fields") is None:
+            return payload
+        previous = json.loads(row[1]).get("_fields")
+        if previous is None:
+            return dict(payload, _fields=None)
+        return dict(payload, _fields=sorted(set(previous) | set(payload["_fields"])))
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._queued)
+
+    def pending(self):
+        if not self.pending_count():
+            return []
+        try:
+            with self._lock, self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT key, action, payload, queued_at, attempts FROM pending_writes ORDER BY queued_at"
+                ).fetchall()
+        except Exception as exc:
+            print(f"write queue read failed: {type(exc).__name__}: {exc}")
+            return []
+        return [
+            {"key": key, "action": action, "payload": json.loads(payload), "queued_at": queued_at, "attempts": attempts}
+            for key, action, payload, queued_at, attempts in rows
+        ]
+
+    def overlay(self, items):
+        """Re-apply journaled edits on top of a remote snapshot that may not contain them yet."""
+        entries = self.pending()
+        if not entries:
+            return items
+
+        by_ticker = {item["ticker"]: item for item in items}
+        order = list(by_ticker)
+        for entry in entries:
+            if entry["action"] == "upsert":
+                if entry["key"] not in by_ticker:
+                    order.append(entry["key"])
+                by_ticker[entry["key"]] = _normalize_item(entry["payload"])
+            elif entry["action"] == "delete":
+                by_ticker.pop(entry["key"], None)
+            elif entry["action"] == "reorder":
+                ranks = {ticker: i for i, ticker in enumerate(entry["payload"])}
+                order.sort(key=lambda ticker: ranks.get(ticker, len(ranks)))
+        return [by_ticker[ticker] for ticker in order if ticker in by_ticker]
+
+    def flush(self):
+        """Send every journaled edit in at most one call per action; returns False when a retry is needed."""
+        entries = self.pending()
+        if not entries:
+            return True
+
+        upserts = [entry["payload"] for entry in entries if entry["action"] == "upsert"]
+        deletes = [entry["key"] for entry in entries if entry["action"] == "delete"]
+        orders = [entry["payload"] for entry in entries if entry["action"] == "reorder"]
+        calls = []
+        if upserts:
+            calls.append(("upsert_targets", {"items": upserts}))
+        if deletes:
+            calls.append(("delete_targets", {"tickers": deletes}))
+        if orders:
+            calls.append(("reorder_targets", {"tickers": orders[-1]}))
+
+        repository = get_watchlist_repository()
+        base_version = repository.remote_version
+        stale = False
+        try:
+            try:
+                for action, payload in calls:
+                    if base_version is not None:
+                        payload["base_version"] = base_version
+                    response = _execute_sheets(action, payload)
+                    stale = stale or bool(response.get("stale")) or bool(response.get("conflicts"))
+                    base_version = response.get("version", base_version)
+            except RuntimeError as exc:
+                if "Unknown action" not in str(exc):
+                    raise
+                # Apps Script 尚未重新部署新版時退回整表寫入
+                response = _execute_sheets("save_watchlist", {"items": _normalize_for_save(repository.get())})
+                base_version = response.get("version")
+        except Exception as exc:
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            self._mark_failed(entries, self.last_error)
+            return False
+
+        self.last_error = None
+        self._remove(entries)
+        repository.record_remote_write(base_version, stale)
+        return True
+
+    def _remove(self, entries):
+        # 只刪掉送出的那一版；flush 期間又被編輯的 ticker 留到下一輪
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM pending_writes WHERE key = ? AND queued_at = ?",
+                [(entry["key"], entry["queued_at"]) for entry in entries],
+            )
+            for entry in entries:
+                if self._queued.get(entry["key"]) == entry["queued_at"]:
+                    del self._queued[entry["key"]]
+
+    def _mark_failed(self, entries, error):
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE pending_writes SET attempts = attempts + 1, last_error = ? WHERE key = ? AND queued_at = ?",
+                [(error, entry["key"], entry["queued_at"]) for entry in entries],
+            )
+
+    def _retry_delay(self):
+        attempts = max((entry["attempts"] for entry in self.pending()), default=1)
+        return WRITE_QUEUE_RETRY_SECONDS[min(max(attempts, 1), len(WRITE_QUEUE_RETRY_SECONDS)) - 1]
+
+    def _run(self):
+        delay = None
+        while True:
+            self._wake.wait(timeout=delay)
+            self._wake.clear()
+            # 等一下讓連續的編輯合併成一次寫入
+            time.sleep(self.debounce_seconds)
+            delay = None if self.flush() else self._retry_delay()
+
+
+@st.cache_resource
+def get_write_queue():
+    return WatchlistWriteQueue().start()
+
+
+def get_pending_write_status():
+    """(number of edits waiting for Google Sheets, last flush error or None)."""
+    queue = get_write_queue()
+    return queue.pending_count(), queue.last_error
+
+
+@st.cache_resource
+def get_watchlist_repository():
+    return WatchlistRepository()
+
+
+def load_watchlist():
+    return get_watchlist_repository().get()
+
+
+def load_watchlist_from_remote():
+    return get_watchlist_repository().get(force_remote=True)
 
 
 def invalidate_watchlist_cache():
-    """Call after any write operation to clear the watchlist cache."""
-    for fn in (load_watchlist, load_watchlist_from_remote):
-        clear = getattr(fn, "clear", None)
-        if clear:
-            clear()
+    """Call after any write operation so the next load re-reads Google Sheets."""
+    get_watchlist_repository().invalidate()
+
+
+def _normalize_for_save(data):
+    normalized = []
+    for i, item in enumerate(_ensure_cash_item(data)):
+        clean_item = _normalize_item(item)
+        clean_item["display_order"] = i
+        if clean_item["ticker"]:
+            normalized.append(clean_item)
+    return normalized
 
 
 def save_watchlist(data):
-    """Save the complete watchlist to Google Sheets."""
+    """Save the complete watchlist to Google Sheets (full rewrite; used for imports)."""
     try:
-        normalized = []
-        for i, item in enumerate(_ensure_cash_item(data)):
-            clean_item = _normalize_item(item)
-            clean_item["display_order"] = i
-            if clean_item["ticker"]:
-                normalized.append(clean_item)
-        _execute_sheets("save_watchlist", {"items": normalized})
-        _save_local_watchlist(normalized)
-        invalidate_watchlist_cache()
+        normalized = _normalize_for_save(data)
+        response = _execute_sheets("save_watchlist", {"items": normalized})
+        repository = get_watchlist_repository()
+        repository.commit(normalized)
+        repository.record_remote_write(response.get("version"))
         return True
     except Exception:
         return False
 
 
+def _queue_edit(data, key, action, payload):
+    """
+    Apply an edit to memory and the local backup immediately and let the write-behind
+    queue send the row-level change (upsert / delete / reorder) to Google Sheets.
+    """
+    normalized = _normalize_for_save(data)
+    get_watchlist_repository().commit(normalized)
+    get_write_queue().enqueue(key, action, payload(normalized) if callable(payload) else payload)
+    return True
+
+
+def _queue_upsert(data, ticker, fields=None):
+    """
+    Queue a row upsert. `fields` lists the columns this edit changed; Apps Script then
+    patches only those cells, so concurrent edits to other fields of the row are kept.
+    """
+    def payload(normalized):
+        item = next(item for item in normalized if item["ticker"] == ticker)
+        return item if fields is None else dict(item, _fields=list(fields))
+
+    return _queue_edit(data, ticker, "upsert", payload)
+
+
 def add_ticker_to_watchlist(ticker):
     # Check if .TW needs to fallback to .TWO
     if ticker.endswith(".TW"):
-        import yfinance as yf
-
-        try:
-            t_orig = yf.Ticker(ticker)
-            hist = t_orig.history(period="1d")
-            if hist.empty:
-                fallback_ticker = ticker.replace(".TW", ".TWO")
-                t_fall = yf.Ticker(fallback_ticker)
-                hist_fall = t_fall.history(period="1d")
-                if not hist_fall.empty:
-                    ticker = fallback_ticker
-        except Exception:
-            pass
+        registry = get_symbol_registry()
+        resolved = registry.resolve(ticker)
+        if resolved:
+            ticker = resolved
+        else:
+            import yfinance as yf
+
+            try:
+                t_orig = yf.Ticker(ticker)
+                hist = t_orig.history(period="1d")
+                if hist.empty:
+                    fallback_ticker = ticker.replace(".TW", ".TWO")
+                    t_fall = yf.Ticker(fallback_ticker)
+                    hist_fall = t_fall.history(period="1d")
+                    if not hist_fall.empty:
+                        registry.record(ticker, fallback_ticker)
+                        ticker = fallback_ticker
+                else:
+                    registry.record(ticker, ticker)
+            except Exception:
+                pass
 
     try:
         data = load_watchlist()
@@ -477,7 +1017,7 @@ def add_ticker_to_watchlist(ticker):
         new_item = get_default_item(ticker)
         new_item["display_order"] = len(data)
         data.append(new_item)
-        if save_watchlist(data):
+        if _queue_upsert(data, ticker):
             return True, f"Added {ticker}"
         return False, "Could not save ticker to Google Sheets."
     except Exception:
@@ -487,7 +1027,7 @@ def add_ticker_to_watchlist(ticker):
 def remove_ticker_from_watchlist(ticker):
     try:
         data = [item for item in load_watchlist() if item.get("ticker") != ticker]
-        return save_watchlist(data)
+        return _queue_edit(data, ticker, "delete", {})
     except Exception:
         return False
 
@@ -502,6 +1042,7 @@ def update_ticker_data(
     shares=0.0,
     tags=None,
     custom_name="",
+    currency=None,
 ):
     if tags is None:
         tags = []
@@ -511,6 +1052,7 @@ def update_ticker_data(
         updated = False
         for item in data:
             if item.get("ticker") == ticker:
+                before = _normalize_item(item)
                 item.update(
                     {
                         "note": note,
@@ -524,11 +1066,17 @@ def update_ticker_data(
                         "holding": _coerce_float(shares) > 0,
                     }
                 )
+                if currency is not None:
+                    item["currency"] = currency
+                after = _normalize_item(item)
                 updated = True
                 break
         if not updated:
             return False
-        return save_watchlist(data)
+        changed = [key for key in after if key != "display_order" and after[key] != before.get(key)]
+        if not changed:
+            return True
+        return _queue_upsert(data, ticker, fields=changed)
     except Exception:
         return False
 
@@ -541,7 +1089,12 @@ def save_item_order(ordered_items):
             if item.get("ticker") in order_by_ticker:
                 item["display_order"] = order_by_ticker[item["ticker"]]
         data.sort(key=lambda item: item.get("display_order", 0))
-        return save_watchlist(data)
+        return _queue_edit(
+            data,
+            ORDER_JOURNAL_KEY,
+            "reorder",
+            lambda normalized: [item["ticker"] for item in normalized],
+        )
     except Exception:
         return False
 
@@ -550,19 +1103,22 @@ def _default_settings():
     return {"refresh_interval": 60, "tag_colors": {}, "default_period": "1M"}
 
 
+def _normalize_settings(settings):
+    merged = _default_settings()
+    merged.update(settings)
+    merged["refresh_interval"] = _coerce_int(merged.get("refresh_interval"), 60)
+    merged["tag_colors"] = _decode_json_field(merged.get("tag_colors"), {})
+    if not isinstance(merged["tag_colors"], dict):
+        merged["tag_colors"] = {}
+    merged["default_period"] = merged.get("default_period") or "1M"
+    return merged
+
+
 def _load_local_settings():
     try:
         if os.path.exists("settings.json"):
             with open("settings.json", "r", encoding="utf-8") as f:
-                local_settings = json.load(f)
-            settings = _default_settings()
-            settings.update(local_settings)
-            settings["refresh_interval"] = _coerce_int(settings.get("refresh_interval"), 60)
-            settings["tag_colors"] = _decode_json_field(settings.get("tag_colors"), {})
-            if not isinstance(settings["tag_colors"], dict):
-                settings["tag_colors"] = {}
-            settings["default_period"] = settings.get("default_period") or "1M"
-            return settings
+                return _normalize_settings(json.load(f))
     except Exception:
         pass
     return None
@@ -571,15 +1127,7 @@ def _load_local_settings():
 @st.cache_data(ttl=30)
 def load_settings_from_storage():
     response = _execute_sheets("load_settings")
-    settings = response.get("settings") or {}
-    merged = _default_settings()
-    merged.update(settings)
-    merged["refresh_interval"] = _coerce_int(merged.get("refresh_interval"), 60)
-    merged["tag_colors"] = _decode_json_field(merged.get("tag_colors"), {})
-    if not isinstance(merged["tag_colors"], dict):
-        merged["tag_colors"] = {}
-    merged["default_period"] = merged.get("default_period") or "1M"
-    return merged
+    return _normalize_settings(response.get("settings") or {})
 
 
 def load_settings(force_remote=False):
@@ -588,7 +1136,8 @@ def load_settings(force_remote=False):
         return local_settings
 
     try:
-        settings = load_settings_from_storage()
+        # watchlist 的 bootstrap 已經帶回 settings 時不必再打一次 load_settings
+        settings = get_watchlist_repository().settings or load_settings_from_storage()
         with open("settings.json", "w", encoding="utf-8") as f:
             json.dump(settings, f, ensure_ascii=False, indent=2)
         return settings
@@ -608,6 +1157,7 @@ def save_settings(settings):
     try:
         _execute_sheets("save_settings", {"settings": settings or {}})
         load_settings_from_storage.clear()
+        get_watchlist_repository().settings = _normalize_settings(settings or {})
         return True
     except Exception:
         return False